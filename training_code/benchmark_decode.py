@@ -0,0 +1,135 @@
+"""
+Benchmark image decode paths used by the data loaders
+
+Compares full-resolution PIL decoding against reduced-resolution JPEG
+(draft mode) decoding and torchvision's native decoder. Every path is
+resized to the model input size, and outputs are compared pixel-wise
+against the full-decode baseline. Encoded images are read into memory
+first, so timings exclude file or archive reads.
+"""
+import argparse
+import io
+import json
+import random
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+from torchvision.io import decode_image, ImageReadMode
+
+import config
+from utils.dataset import ZipImageDataset, get_split_dataset, open_image
+
+
+def decode_pil_full(data, img_size):
+    """Baseline: full PIL decode followed by a resize"""
+    img = open_image(io.BytesIO(data))
+    return np.asarray(img.resize((img_size, img_size), Image.BILINEAR))
+
+
+def decode_pil_draft(data, img_size):
+    """Reduced-resolution JPEG decode followed by a resize"""
+    img = open_image(io.BytesIO(data), (img_size, img_size))
+    return np.asarray(img.resize((img_size, img_size), Image.BILINEAR))
+
+
+def decode_torchvision(data, img_size):
+    """torchvision native decode followed by an antialiased tensor resize"""
+    img = decode_image(torch.frombuffer(bytearray(data), dtype=torch.uint8), mode=ImageReadMode.RGB)
+    img = transforms.functional.resize(img, [img_size, img_size], antialias=True)
+    return img.permute(1, 2, 0).numpy()
+
+
+DECODERS = {
+    'pil_full': decode_pil_full,
+    'pil_draft': decode_pil_draft,
+    'torchvision': decode_torchvision,
+}
+
+
+def read_encoded(dataset, indices):
+    """
+    Encoded bytes of dataset samples, from files or from the dataset archive
+    
+    Args:
+        dataset: Dataset returned by get_split_dataset
+        indices: Sample indices
+    
+    Returns:
+        List of bytes
+    """
+    if isinstance(dataset, ZipImageDataset):
+        return [dataset.read_bytes(i) for i in indices]
+    images = []
+    for i in indices:
+        with open(dataset.samples[i][0], 'rb') as f:
+            images.append(f.read())
+    return images
+
+
+def benchmark(images, img_size, repeats=3):
+    """
+    Time every decoder and compare outputs with the full-decode baseline
+    
+    Args:
+        images: Encoded images (bytes) to decode
+        img_size: Target image size
+        repeats: Timed passes over the images per decoder
+    
+    Returns:
+        Dictionary of decoder name to timing and tolerance statistics
+    """
+    baseline = [decode_pil_full(data, img_size).astype(np.int16) for data in images]
+    
+    results = {}
+    for name, decoder in DECODERS.items():
+        timings = []
+        for _ in range(repeats):
+            for data in images:
+                start = time.perf_counter()
+                decoder(data, img_size)
+                timings.append((time.perf_counter() - start) * 1000.0)
+        
+        diffs = [np.abs(decoder(data, img_size).astype(np.int16) - ref) for data, ref in zip(images, baseline)]
+        mean_diff = np.array([d.mean() for d in diffs])
+        max_diff = np.array([d.max() for d in diffs])
+        
+        results[name] = {
+            'mean_ms': float(np.mean(timings)),
+            'median_ms': float(np.median(timings)),
+            'mean_abs_diff': float(mean_diff.mean()),
+            'p99_abs_diff': float(np.percentile(np.concatenate([d.ravel() for d in diffs]), 99)),
+            'max_abs_diff': int(max_diff.max()),
+        }
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark image decode paths')
+    parser.add_argument('--split', type=str, default='val', choices=['train', 'val', 'test'],
+                        help='Dataset split to sample images from')
+    parser.add_argument('--num_images', type=int, default=200, help='Number of images to sample')
+    parser.add_argument('--img_size', type=int, default=config.IMG_SIZE, help='Target image size')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed passes per decoder')
+    
+    args = parser.parse_args()
+    
+    dataset = get_split_dataset(args.split, img_size=args.img_size)
+    random.seed(config.SEED)
+    indices = random.sample(range(len(dataset)), min(args.num_images, len(dataset)))
+    images = read_encoded(dataset, indices)
+    
+    torch.set_num_threads(1)
+    results = benchmark(images, args.img_size, args.repeats)
+    
+    print(f"\n{'Decoder':<12} {'Mean ms':>8} {'Median ms':>10} {'Mean |d|':>9} {'P99 |d|':>8} {'Max |d|':>8}")
+    for name, row in results.items():
+        print(f"{name:<12} {row['mean_ms']:>8.2f} {row['median_ms']:>10.2f} "
+              f"{row['mean_abs_diff']:>9.2f} {row['p99_abs_diff']:>8.1f} {row['max_abs_diff']:>8d}")
+    
+    out_dir = config.EXPERIMENT_DIR / 'benchmarks'
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / 'decode.json', 'w') as f:
+        json.dump({'args': vars(args), 'results': results}, f, indent=2)
@@ -0,0 +1,314 @@
+"""
+Confidence-gated cascade inference
+
+A cheap first stage (a low-resolution pass, or a smaller registered backbone)
+classifies every image. Only samples whose softmax confidence or top-2
+margin falls below a threshold are escalated to the full model, and
+escalated samples are regrouped into full batches before the expensive
+forward pass. The threshold is calibrated on the validation split to a
+target accuracy loss relative to the full model.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from sklearn.metrics import f1_score
+
+import config
+from models import MODEL_BUILDERS
+from utils.checkpoint import load_model
+from utils.dataset import SharedDecodeDataset
+from utils.transforms import resize_normalize_batch
+
+
+def gate_score(probs, score='confidence'):
+    """
+    Certainty score used to decide whether to escalate
+    
+    Args:
+        probs: Softmax probabilities [N, num_classes]
+        score: 'confidence' (top-1 probability) or 'margin' (top-1 minus top-2)
+    
+    Returns:
+        Tensor of scores [N]
+    """
+    if score == 'confidence':
+        return probs.max(dim=1).values
+    if score == 'margin':
+        top2 = probs.topk(2, dim=1).values
+        return top2[:, 0] - top2[:, 1]
+    raise ValueError(f"Score {score} not supported. Choose from ['confidence', 'margin']")
+
+
+class CascadePredictor:
+    """
+    Two-stage classifier that escalates uncertain samples to the full model
+    """
+    
+    def __init__(self, cheap_model, cheap_size, full_model, full_size,
+                 threshold=0.0, score='confidence', batch_size=32, device='cpu'):
+        """
+        Args:
+            cheap_model: First-stage model
+            cheap_size: First-stage input resolution
+            full_model: Second-stage model
+            full_size: Second-stage input resolution
+            threshold: Samples with a gate score below this are escalated
+            score: Gate score ('confidence' or 'margin')
+            batch_size: Batch size of the regrouped second stage
+            device: Device the models live on
+        """
+        self.cheap_model = cheap_model
+        self.cheap_size = cheap_size
+        self.full_model = full_model
+        self.full_size = full_size
+        self.threshold = threshold
+        self.score = score
+        self.batch_size = batch_size
+        self.device = torch.device(device)
+        
+        self.mean = torch.tensor(config.MEAN, device=self.device).view(1, 3, 1, 1)
+        self.std = torch.tensor(config.STD, device=self.device).view(1, 3, 1, 1)
+    
+    def cheap_probs(self, images):
+        """First-stage probabilities for a batch of uint8 decodes"""
+        with torch.no_grad():
+            inputs = resize_normalize_batch(images, self.cheap_size, self.mean, self.std)
+            return torch.softmax(self.cheap_model(inputs), dim=1)
+    
+    def full_probs(self, images):
+        """Second-stage probabilities for a batch of uint8 decodes"""
+        with torch.no_grad():
+            inputs = resize_normalize_batch(images, self.full_size, self.mean, self.std)
+            return torch.softmax(self.full_model(inputs), dim=1)
+    
+    def predict_loader(self, dataloader):
+        """
+        Run the cascade over a dataset
+        
+        Escalated samples from consecutive input batches are buffered and
+        sent to the full model in batches of batch_size.
+        
+        Args:
+            dataloader: DataLoader over a SharedDecodeDataset (no shuffling)
+        
+        Returns:
+            Final probabilities [N, num_classes], labels [N] and a boolean
+            escalation mask [N]
+        """
+        all_probs = []
+        all_labels = []
+        all_escalated = []
+        buffer_images = []
+        buffer_index = []
+        offset = 0
+        
+        def flush(count):
+            images = torch.cat(buffer_images)
+            index = torch.cat(buffer_index)
+            probs = self.full_probs(images[:count]).cpu()
+            for i, p in zip(index[:count].tolist(), probs):
+                all_probs[i] = p
+            buffer_images[:] = [images[count:]] if count < len(images) else []
+            buffer_index[:] = [index[count:]] if count < len(index) else []
+        
+        for images, labels in dataloader:
+            images = images.to(self.device, non_blocking=True)
+            probs = self.cheap_probs(images)
+            escalate = gate_score(probs, self.score) < self.threshold
+            
+            all_probs.extend(probs.cpu())
+            all_labels.append(labels.numpy())
+            all_escalated.append(escalate.cpu().numpy())
+            
+            if escalate.any():
+                idx = torch.nonzero(escalate).squeeze(1)
+                buffer_images.append(images[idx])
+                buffer_index.append(idx.cpu() + offset)
+            
+            while sum(len(b) for b in buffer_images) >= self.batch_size:
+                flush(self.batch_size)
+            
+            offset += len(labels)
+        
+        remaining = sum(len(b) for b in buffer_images)
+        if remaining:
+            flush(remaining)
+        
+        return torch.stack(all_probs).numpy(), np.concatenate(all_labels), np.concatenate(all_escalated)
+
+
+def collect_stage_outputs(predictor, dataloader):
+    """
+    Run both stages over every sample of a dataset
+    
+    Returns:
+        Cheap probabilities, full probabilities and labels as numpy arrays
+    """
+    cheap = []
+    full = []
+    all_labels = []
+    for images, labels in dataloader:
+        images = images.to(predictor.device, non_blocking=True)
+        cheap.append(predictor.cheap_probs(images).cpu().numpy())
+        full.append(predictor.full_probs(images).cpu().numpy())
+        all_labels.append(labels.numpy())
+    return np.concatenate(cheap), np.concatenate(full), np.concatenate(all_labels)
+
+
+def calibrate_threshold(cheap_probs, full_probs, labels, target_loss=0.005, score='confidence'):
+    """
+    Lowest-escalation threshold whose accuracy loss stays within the target
+    
+    Args:
+        cheap_probs: First-stage probabilities on the calibration split
+        full_probs: Second-stage probabilities on the calibration split
+        labels: Ground truth labels
+        target_loss: Allowed accuracy drop relative to the full model
+        score: Gate score ('confidence' or 'margin')
+    
+    Returns:
+        Dictionary with the threshold, escalation rate and accuracies
+    """
+    scores = gate_score(torch.from_numpy(cheap_probs), score).numpy()
+    cheap_correct = cheap_probs.argmax(axis=1) == labels
+    full_correct = full_probs.argmax(axis=1) == labels
+    full_acc = full_correct.mean()
+    
+    # Candidate thresholds between consecutive distinct scores; escalating
+    # the k least certain samples gives accuracy from the cumulative sums
+    order = np.argsort(scores, kind='stable')
+    sorted_scores = scores[order]
+    n = len(scores)
+    escalated_correct = np.concatenate([[0], np.cumsum(full_correct[order])])
+    kept_correct = np.concatenate([np.cumsum(cheap_correct[order][::-1])[::-1], [0]])
+    accuracy = (escalated_correct + kept_correct) / n
+    
+    valid = np.ones(n + 1, dtype=bool)
+    valid[1:n] = sorted_scores[1:] > sorted_scores[:-1]
+    ok = np.nonzero(valid & (accuracy >= full_acc - target_loss))[0]
+    k = int(ok[0]) if len(ok) else n
+    
+    if k == 0:
+        threshold = float(sorted_scores[0])
+    elif k == n:
+        threshold = float('inf')
+    else:
+        threshold = float((sorted_scores[k - 1] + sorted_scores[k]) / 2)
+    
+    return {
+        'threshold': threshold,
+        'escalation_rate': k / n,
+        'cascade_accuracy': float(accuracy[k]),
+        'full_accuracy': float(full_acc),
+        'cheap_accuracy': float(cheap_correct.mean()),
+    }
+
+
+def _timed(device, fn):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    result = fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return result, time.perf_counter() - start
+
+
+def benchmark(predictor, dataloader):
+    """
+    Compare the cascade against the full model alone
+    
+    Returns:
+        Dictionary with escalation rate, macro-F1 and mean latency of both
+    """
+    def full_only():
+        probs = []
+        labels = []
+        for images, batch_labels in dataloader:
+            probs.append(predictor.full_probs(images.to(predictor.device)).cpu().numpy())
+            labels.append(batch_labels.numpy())
+        return np.concatenate(probs), np.concatenate(labels)
+    
+    (full_probs, labels), full_time = _timed(predictor.device, full_only)
+    (cascade_probs, _, escalated), cascade_time = _timed(
+        predictor.device, lambda: predictor.predict_loader(dataloader)
+    )
+    
+    n = max(len(labels), 1)
+    full_ms = 1000.0 * full_time / n
+    cascade_ms = 1000.0 * cascade_time / n
+    return {
+        'escalation_rate': float(escalated.mean()),
+        'full_f1_macro': float(f1_score(labels, full_probs.argmax(axis=1), average='macro', zero_division=0)),
+        'cascade_f1_macro': float(f1_score(labels, cascade_probs.argmax(axis=1), average='macro', zero_division=0)),
+        'full_accuracy': float((full_probs.argmax(axis=1) == labels).mean()),
+        'cascade_accuracy': float((cascade_probs.argmax(axis=1) == labels).mean()),
+        'full_latency_ms': full_ms,
+        'cascade_latency_ms': cascade_ms,
+        'latency_reduction': 1.0 - cascade_ms / full_ms if full_ms > 0 else 0.0,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calibrate and benchmark cascade inference')
+    parser.add_argument('--full_model', type=str, default='efficientnet_b2',
+                        choices=list(MODEL_BUILDERS.keys()), help='Second-stage model')
+    parser.add_argument('--cheap_model', type=str, default='efficientnet_b2',
+                        choices=list(MODEL_BUILDERS.keys()),
+                        help='First-stage model (the same weights are reused if equal to --full_model)')
+    parser.add_argument('--cheap_size', type=int, default=160, help='First-stage input resolution')
+    parser.add_argument('--score', type=str, default='confidence',
+                        choices=['confidence', 'margin'], help='Gate score')
+    parser.add_argument('--target_loss', type=float, default=0.005,
+                        help='Allowed validation accuracy drop relative to the full model')
+    parser.add_argument('--batch_size', type=int, default=32, help='Batch size')
+    
+    args = parser.parse_args()
+    
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    full_size = config.MODEL_IMG_SIZES.get(args.full_model, config.IMG_SIZE)
+    
+    full_model = load_model(args.full_model, device=device)
+    if args.cheap_model == args.full_model:
+        cheap_model = full_model
+    else:
+        cheap_model = load_model(args.cheap_model, device=device)
+    
+    predictor = CascadePredictor(
+        cheap_model, args.cheap_size, full_model, full_size,
+        score=args.score, batch_size=args.batch_size, device=device
+    )
+    
+    def make_loader(split):
+        return DataLoader(
+            SharedDecodeDataset(split, max(full_size, args.cheap_size)),
+            batch_size=args.batch_size,
+            shuffle=False,
+            num_workers=config.NUM_WORKERS,
+            pin_memory=device.type == 'cuda'
+        )
+    
+    print("Calibrating on validation split...")
+    cheap_probs, full_probs, labels = collect_stage_outputs(predictor, make_loader('val'))
+    calibration = calibrate_threshold(cheap_probs, full_probs, labels, args.target_loss, args.score)
+    predictor.threshold = calibration['threshold']
+    print(f"Threshold: {calibration['threshold']:.4f}, "
+          f"Val escalation rate: {calibration['escalation_rate']:.2%}, "
+          f"Val accuracy: {calibration['cascade_accuracy']:.4f} (full: {calibration['full_accuracy']:.4f})")
+    
+    print("Benchmarking on test split...")
+    results = benchmark(predictor, make_loader('test'))
+    print(f"Escalation rate: {results['escalation_rate']:.2%}")
+    print(f"F1 (Macro) - Full: {results['full_f1_macro']:.4f}, Cascade: {results['cascade_f1_macro']:.4f}")
+    print(f"Latency - Full: {results['full_latency_ms']:.2f} ms/image, "
+          f"Cascade: {results['cascade_latency_ms']:.2f} ms/image "
+          f"({results['latency_reduction']:.1%} reduction)")
+    
+    out_dir = config.EXPERIMENT_DIR / args.full_model / 'results'
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / 'cascade.json', 'w') as f:
+        json.dump({'args': vars(args), 'calibration': calibration, 'test': results}, f, indent=2)
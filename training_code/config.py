@@ -13,22 +13,49 @@ TRAIN_DIR = DATA_ROOT / "train_balanced"
 VAL_DIR = DATA_ROOT / "split_val"
 TEST_DIR = DATA_ROOT / "test"
 
+# Dataset archive (zip with the same layout); if set, images are read from it
+# directly instead of from the extracted directories above
+DATA_ARCHIVE = None  # e.g. Path(r"C:\Users\tonkla\Downloads\SkinDisease.zip")
+
 # Experiment directory
 EXPERIMENT_DIR = BASE_DIR / "experiments"
 EXPERIMENT_DIR.mkdir(exist_ok=True)
+ARCHIVE_INDEX_CACHE = EXPERIMENT_DIR / "archive_index.json"  # Cached archive member index
+
+# Per-sample prediction store
+PREDICTION_STORE_DIR = EXPERIMENT_DIR / "predictions"
+
+# Inference prediction cache
+PREDICTION_CACHE_DIR = EXPERIMENT_DIR / "prediction_cache"
+CACHE_MEMORY_ITEMS = 4096
+CACHE_DISK_BYTES = 1024 ** 3  # 1 GB
 
 # Image settings
 IMG_SIZE = 260
 MEAN = [0.485, 0.456, 0.406]  # ImageNet normalization
 STD = [0.229, 0.224, 0.225]
+TILE_MAX_SIDE = 1560  # Longest image side before tiling (6 tiles of IMG_SIZE)
+TILE_MIN_STD = 8.0  # Tiles with a lower grayscale std are treated as background
+FAST_JPEG_DECODE = True  # Decode JPEGs at a reduced DCT scale close to the target size
+
+# Native input resolution of each supported backbone
+MODEL_IMG_SIZES = {
+    "efficientnet_b2": 260,
+    "efficientnet_b3": 300,
+    "efficientnet_b4": 380,
+}
 
 # Training settings
 BATCH_SIZE = 32
 NUM_WORKERS = 4
+LOADER_TUNING_CACHE = EXPERIMENT_DIR / "loader_tuning.json"  # Per-host DataLoader auto-tune results
 NUM_CLASSES = 22
 EPOCHS = 30
 SEED = 42
 
+# Incremental fine-tuning
+REPLAY_BUFFER_SIZE = 2200  # Old samples replayed per update (class-balanced)
+
 # Class names (matching folder structure)
 CLASS_NAMES = [
     "Acne",
@@ -84,9 +111,20 @@ CLASS_NAMES_TH = {
 # Device configuration
 DEVICE = "cuda"  # Will be set dynamically in training script
 
+# Staged unfreezing: 'epoch:first_trainable_features_block,...'
+UNFREEZE_SCHEDULE = "1:6,4:4,7:2,10:0"
+LAYER_LR_DECAY = 0.7  # Learning rate multiplier per features block below the classifier
+
+# Selective backpropagation
+SELECTIVE_BACKPROP_HISTORY = 10000  # Recent per-sample losses used for percentile selection
+
 # Early stopping
 EARLY_STOPPING_PATIENCE = 5
 
 # Model checkpointing
 SAVE_BEST_ONLY = True
 MONITOR_METRIC = "f1_macro"  # Options: 'f1_macro', 'accuracy', 'loss'
+
+# Reporting
+REPORT_QUALITY = "standard"  # Options: 'draft', 'standard', 'publication'
+FINAL_REPORT_QUALITY = "publication"
@@ -0,0 +1,313 @@
+"""
+Multi-model ensemble inference with shared preprocessing
+
+Each image is decoded once and resized to the largest member resolution.
+Every member then gets its own resized, normalized view of that shared
+decode on the device, members run concurrently in a thread pool, and their
+logits are fused with configurable weights.
+"""
+import argparse
+import itertools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from sklearn.metrics import f1_score
+
+import config
+from models import MODEL_BUILDERS
+from utils.checkpoint import load_model
+from utils.dataset import SharedDecodeDataset
+from utils.transforms import resize_normalize_batch
+
+
+class EnsemblePredictor:
+    """
+    Runs several classifiers over the same batch and fuses their logits
+    """
+    
+    def __init__(self, members, weights=None, device='cpu', agreement_members=0):
+        """
+        Args:
+            members: List of (name, model, img_size) tuples
+            weights: Fusion weight of each member (default: equal)
+            device: Device the members live on
+            agreement_members: If >= 2, run only the first N members first and
+                skip the remaining members for samples on which they agree
+        """
+        self.members = members
+        self.device = torch.device(device)
+        weights = weights if weights is not None else [1.0] * len(members)
+        if len(weights) != len(members):
+            raise ValueError(f"Got {len(weights)} weights for {len(members)} members")
+        self.weights = [float(w) for w in weights]
+        self.agreement_members = agreement_members
+        
+        self.mean = torch.tensor(config.MEAN, device=self.device).view(1, 3, 1, 1)
+        self.std = torch.tensor(config.STD, device=self.device).view(1, 3, 1, 1)
+        self.pool = ThreadPoolExecutor(max_workers=len(members))
+    
+    @property
+    def max_img_size(self):
+        return max(img_size for _, _, img_size in self.members)
+    
+    def member_view(self, images, img_size):
+        """
+        Derive a normalized member input from a shared uint8 decode
+        
+        Args:
+            images: uint8 tensor [N, 3, H, W] on the device
+            img_size: Member input resolution
+        
+        Returns:
+            Normalized float tensor [N, 3, img_size, img_size]
+        """
+        return resize_normalize_batch(images, img_size, self.mean, self.std)
+    
+    def _run_member(self, index, images):
+        _, model, img_size = self.members[index]
+        with torch.no_grad():
+            return model(self.member_view(images, img_size))
+    
+    def member_logits(self, images, indices=None):
+        """
+        Run members concurrently over the same batch
+        
+        Args:
+            images: uint8 tensor [N, 3, H, W] on the device
+            indices: Member indices to run (default: all)
+        
+        Returns:
+            Dictionary of member index to logits
+        """
+        indices = list(range(len(self.members))) if indices is None else list(indices)
+        futures = {i: self.pool.submit(self._run_member, i, images) for i in indices}
+        return {i: future.result() for i, future in futures.items()}
+    
+    def fuse(self, logits_by_member):
+        """
+        Weighted average of member logits
+        
+        Args:
+            logits_by_member: Dictionary of member index to logits
+        
+        Returns:
+            Fused logits
+        """
+        total = sum(self.weights[i] for i in logits_by_member)
+        fused = None
+        for i, logits in logits_by_member.items():
+            term = logits * (self.weights[i] / total)
+            fused = term if fused is None else fused + term
+        return fused
+    
+    def predict(self, images):
+        """
+        Predict a batch of shared decodes
+        
+        Args:
+            images: uint8 tensor [N, 3, H, W]
+        
+        Returns:
+            Fused logits [N, num_classes] and a boolean mask of samples that
+            were resolved by the agreement stage
+        """
+        images = images.to(self.device, non_blocking=True)
+        num_members = len(self.members)
+        
+        if not 2 <= self.agreement_members < num_members:
+            fused = self.fuse(self.member_logits(images))
+            return fused, torch.zeros(len(images), dtype=torch.bool, device=self.device)
+        
+        first = list(range(self.agreement_members))
+        rest = list(range(self.agreement_members, num_members))
+        
+        logits = self.member_logits(images, first)
+        preds = torch.stack([logits[i].argmax(dim=1) for i in first])
+        agree = (preds == preds[0]).all(dim=0)
+        
+        fused = self.fuse(logits)
+        disagree = ~agree
+        if disagree.any():
+            rest_logits = self.member_logits(images[disagree], rest)
+            all_logits = {i: logits[i][disagree] for i in first}
+            all_logits.update(rest_logits)
+            fused[disagree] = self.fuse(all_logits)
+        
+        return fused, agree
+    
+    def close(self):
+        self.pool.shutdown()
+
+
+def _sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def collect_member_outputs(predictor, dataloader):
+    """
+    Run every member over a dataset, timing each one separately
+    
+    Args:
+        predictor: EnsemblePredictor
+        dataloader: DataLoader over a SharedDecodeDataset
+    
+    Returns:
+        Dictionary of member index to logits array, labels array and
+        dictionary of member index to latency in ms/image
+    """
+    num_members = len(predictor.members)
+    outputs = {i: [] for i in range(num_members)}
+    elapsed = {i: 0.0 for i in range(num_members)}
+    all_labels = []
+    num_images = 0
+    
+    for images, labels in dataloader:
+        images = images.to(predictor.device)
+        for i in range(num_members):
+            _sync(predictor.device)
+            start = time.perf_counter()
+            logits = predictor._run_member(i, images)
+            _sync(predictor.device)
+            elapsed[i] += time.perf_counter() - start
+            outputs[i].append(logits.float().cpu().numpy())
+        all_labels.append(labels.numpy())
+        num_images += len(labels)
+    
+    logits = {i: np.concatenate(chunks) for i, chunks in outputs.items()}
+    latency = {i: 1000.0 * elapsed[i] / max(num_images, 1) for i in range(num_members)}
+    return logits, np.concatenate(all_labels), latency
+
+
+def subset_report(predictor, member_outputs, labels, member_latency):
+    """
+    Macro-F1 and latency for every non-empty subset of members
+    
+    Latency is reported as the sequential sum of member latencies and as the
+    slowest member, the lower bound when members run fully in parallel.
+    
+    Returns:
+        List of dictionaries, one per subset, sorted by sequential latency
+    """
+    num_members = len(predictor.members)
+    rows = []
+    for size in range(1, num_members + 1):
+        for subset in itertools.combinations(range(num_members), size):
+            total = sum(predictor.weights[i] for i in subset)
+            fused = sum(member_outputs[i] * (predictor.weights[i] / total) for i in subset)
+            preds = fused.argmax(axis=1)
+            rows.append({
+                'members': [predictor.members[i][0] for i in subset],
+                'f1_macro': float(f1_score(labels, preds, average='macro', zero_division=0)),
+                'accuracy': float((preds == labels).mean()),
+                'latency_sequential_ms': sum(member_latency[i] for i in subset),
+                'latency_parallel_ms': max(member_latency[i] for i in subset),
+            })
+    rows.sort(key=lambda row: row['latency_sequential_ms'])
+    return rows
+
+
+def evaluate_ensemble(predictor, dataloader):
+    """
+    Run the full ensemble (including agreement early-exit) over a dataset
+    
+    Returns:
+        Dictionary with macro-F1, accuracy, agreement rate and ms/image
+    """
+    all_preds = []
+    all_labels = []
+    agreed = 0
+    elapsed = 0.0
+    
+    for images, labels in dataloader:
+        _sync(predictor.device)
+        start = time.perf_counter()
+        fused, agree = predictor.predict(images)
+        _sync(predictor.device)
+        elapsed += time.perf_counter() - start
+        
+        all_preds.append(fused.argmax(dim=1).cpu().numpy())
+        all_labels.append(labels.numpy())
+        agreed += int(agree.sum())
+    
+    preds = np.concatenate(all_preds)
+    labels = np.concatenate(all_labels)
+    return {
+        'f1_macro': float(f1_score(labels, preds, average='macro', zero_division=0)),
+        'accuracy': float((preds == labels).mean()),
+        'agreement_rate': agreed / max(len(labels), 1),
+        'latency_ms': 1000.0 * elapsed / max(len(labels), 1),
+    }
+
+
+def build_predictor(model_names, weights=None, device='cpu', agreement_members=0):
+    """
+    Load trained members and wrap them in an EnsemblePredictor
+    
+    Args:
+        model_names: Model architecture names, each with a best_model.pth
+        weights: Fusion weight of each member
+        device: Device to run on
+        agreement_members: See EnsemblePredictor
+    
+    Returns:
+        EnsemblePredictor
+    """
+    members = []
+    for name in model_names:
+        model = load_model(name, device=device)
+        members.append((name, model, config.MODEL_IMG_SIZES.get(name, config.IMG_SIZE)))
+    return EnsemblePredictor(
+        members, weights=weights, device=device, agreement_members=agreement_members
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate a multi-model ensemble')
+    parser.add_argument('--models', type=str, nargs='+',
+                        default=['efficientnet_b2', 'efficientnet_b3', 'efficientnet_b4'],
+                        choices=list(MODEL_BUILDERS.keys()),
+                        help='Ensemble members (trained checkpoints are required)')
+    parser.add_argument('--weights', type=float, nargs='+', default=None,
+                        help='Fusion weight of each member')
+    parser.add_argument('--agreement_members', type=int, default=0,
+                        help='Stop early when the first N members agree (0 disables)')
+    parser.add_argument('--split', type=str, default='test', choices=['val', 'test'],
+                        help='Dataset split to evaluate')
+    parser.add_argument('--batch_size', type=int, default=32, help='Batch size')
+    
+    args = parser.parse_args()
+    
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    predictor = build_predictor(args.models, args.weights, device, args.agreement_members)
+    
+    dataset = SharedDecodeDataset(args.split, predictor.max_img_size)
+    loader = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=False,
+        num_workers=config.NUM_WORKERS,
+        pin_memory=device.type == 'cuda'
+    )
+    
+    member_outputs, labels, member_latency = collect_member_outputs(predictor, loader)
+    rows = subset_report(predictor, member_outputs, labels, member_latency)
+    ensemble = evaluate_ensemble(predictor, loader)
+    predictor.close()
+    
+    print(f"\n{'Members':<60} {'F1':>7} {'Seq ms':>8} {'Par ms':>8}")
+    for row in rows:
+        print(f"{' + '.join(row['members']):<60} {row['f1_macro']:>7.4f} "
+              f"{row['latency_sequential_ms']:>8.2f} {row['latency_parallel_ms']:>8.2f}")
+    print(f"\nFull ensemble - F1: {ensemble['f1_macro']:.4f}, "
+          f"Latency: {ensemble['latency_ms']:.2f} ms/image, "
+          f"Agreement exits: {ensemble['agreement_rate']:.2%}")
+    
+    out_dir = config.EXPERIMENT_DIR / 'ensemble'
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / f'subset_report_{args.split}.json', 'w') as f:
+        json.dump({'subsets': rows, 'ensemble': ensemble}, f, indent=2)
@@ -0,0 +1,115 @@
+"""
+Evaluate a trained checkpoint and store per-sample predictions
+
+Each evaluation is written to the prediction store under the model name and
+'<checkpoint>_<split>', so confusions, highest-loss samples and
+disagreements between checkpoints can be queried later without re-running
+the model.
+"""
+import argparse
+import json
+from pathlib import Path
+
+import torch
+from torch.utils.data import DataLoader
+
+import config
+from models import MODEL_BUILDERS
+from utils.checkpoint import get_checkpoint_path, load_model
+from utils.dataset import get_split_dataset
+from utils.metrics import evaluate_model
+from utils.prediction_store import PredictionStore
+from utils.reporting import ReportWorker
+from utils.transforms import get_val_transforms
+
+
+def evaluate_checkpoint(model_name, checkpoint_path=None, split='test', batch_size=32,
+                        store=None):
+    """
+    Evaluate a checkpoint on one split and record every sample
+    
+    Args:
+        model_name: Model architecture name
+        checkpoint_path: Path to the checkpoint (default: best_model.pth)
+        split: 'train', 'val' or 'test'
+        batch_size: Batch size
+        store: PredictionStore (default: the store under config.PREDICTION_STORE_DIR)
+    
+    Returns:
+        Result of evaluate_model, plus the 'run_id' and 'checkpoint_id' of
+        the stored record
+    """
+    if checkpoint_path is None:
+        checkpoint_path = get_checkpoint_path(model_name)
+    store = store or PredictionStore()
+    
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    img_size = config.MODEL_IMG_SIZES.get(model_name, config.IMG_SIZE)
+    model = load_model(model_name, checkpoint_path, device=device)
+    
+    dataset = get_split_dataset(split, get_val_transforms(img_size), img_size)
+    loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=config.NUM_WORKERS,
+        pin_memory=device.type == 'cuda'
+    )
+    
+    run_id = model_name
+    checkpoint_id = f'{Path(checkpoint_path).stem}_{split}'
+    results = evaluate_model(
+        model, loader, device, config.CLASS_NAMES,
+        store=store, run_id=run_id, checkpoint_id=checkpoint_id
+    )
+    results['run_id'] = run_id
+    results['checkpoint_id'] = checkpoint_id
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate a checkpoint and store per-sample predictions')
+    parser.add_argument('--model', type=str, default='efficientnet_b2',
+                        choices=list(MODEL_BUILDERS.keys()), help='Model architecture')
+    parser.add_argument('--checkpoint', type=str, default=None,
+                        help='Checkpoint path (default: best_model.pth)')
+    parser.add_argument('--split', type=str, default='test', choices=['train', 'val', 'test'],
+                        help='Dataset split to evaluate')
+    parser.add_argument('--batch_size', type=int, default=32, help='Batch size')
+    parser.add_argument('--compare', type=str, nargs=2, default=None, metavar=('RUN_ID', 'CHECKPOINT_ID'),
+                        help='Stored record to list disagreements with')
+    
+    args = parser.parse_args()
+    
+    store = PredictionStore()
+    results = evaluate_checkpoint(args.model, args.checkpoint, args.split, args.batch_size, store)
+    run_id, checkpoint_id = results['run_id'], results['checkpoint_id']
+    
+    print(f"\nAccuracy: {results['metrics']['accuracy']:.4f}")
+    print(f"F1 (Macro): {results['metrics']['f1_macro']:.4f}")
+    print(results['classification_report'])
+    print(f"✓ Predictions stored as {run_id}/{checkpoint_id}")
+    
+    print("\nMost frequent confusions:")
+    for row in store.confusions(run_id, checkpoint_id)[:10]:
+        print(f"  {row['true']} -> {row['pred']}: {row['count']}")
+    
+    if args.compare:
+        disagreements = store.disagreement(run_id, checkpoint_id, *args.compare)
+        print(f"\n{len(disagreements)} disagreements with {args.compare[0]}/{args.compare[1]}")
+    
+    out_dir = config.EXPERIMENT_DIR / args.model / 'results'
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / f'{checkpoint_id}_metrics.json', 'w') as f:
+        json.dump({k: float(v) for k, v in results['metrics'].items()}, f, indent=2)
+    
+    # Confusion matrix and per-class plots are rendered in the background
+    reporter = ReportWorker(out_dir / checkpoint_id, quality=config.FINAL_REPORT_QUALITY)
+    reporter.submit_evaluation(
+        results['confusion_matrix'],
+        config.CLASS_NAMES,
+        metrics=results['metrics'],
+        per_class=results['per_class']
+    )
+    reporter.close()
+    print(f"✓ Report written to {out_dir / checkpoint_id}")
@@ -0,0 +1,73 @@
+"""
+Export a trained checkpoint as a weights-only deployment artifact
+
+The artifact is loaded with memory mapping (see utils.checkpoint.load_artifact),
+so serving workers share the weight pages and start without deserializing
+optimizer state. After export the artifact is checked against the source
+checkpoint on a random batch and both load times are reported.
+"""
+import argparse
+import time
+
+import torch
+
+from models import MODEL_BUILDERS
+from utils.checkpoint import get_checkpoint_path, load_model, export_artifact, load_artifact
+
+
+def verify_artifact(model_name, checkpoint_path, artifact_path, batch_size=4):
+    """
+    Compare artifact outputs and load time with the source checkpoint
+    
+    Args:
+        model_name: Model architecture name
+        checkpoint_path: Source checkpoint
+        artifact_path: Exported artifact
+        batch_size: Size of the random comparison batch
+    
+    Returns:
+        Dictionary with load times in milliseconds and the maximum absolute
+        logit difference
+    """
+    start = time.perf_counter()
+    reference = load_model(model_name, checkpoint_path)
+    checkpoint_ms = (time.perf_counter() - start) * 1000.0
+    
+    start = time.perf_counter()
+    model, metadata = load_artifact(artifact_path)
+    artifact_ms = (time.perf_counter() - start) * 1000.0
+    
+    img_size = metadata['img_size']
+    images = torch.randn(batch_size, 3, img_size, img_size)
+    with torch.no_grad():
+        max_diff = (reference(images) - model(images)).abs().max().item()
+    
+    return {
+        'checkpoint_load_ms': checkpoint_ms,
+        'artifact_load_ms': artifact_ms,
+        'max_abs_logit_diff': max_diff,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a weights-only deployment artifact')
+    parser.add_argument('--model', type=str, default='efficientnet_b2',
+                        choices=list(MODEL_BUILDERS.keys()), help='Model architecture')
+    parser.add_argument('--checkpoint', type=str, default=None,
+                        help='Source checkpoint (default: best_model.pth)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Artifact path (default: <checkpoints>/<model>.weights.pt)')
+    parser.add_argument('--no_verify', action='store_true',
+                        help='Skip the comparison with the source checkpoint')
+    
+    args = parser.parse_args()
+    
+    checkpoint_path = args.checkpoint or get_checkpoint_path(args.model)
+    artifact_path = export_artifact(args.model, checkpoint_path, args.output)
+    print(f"✓ Artifact saved to {artifact_path}")
+    
+    if not args.no_verify:
+        result = verify_artifact(args.model, checkpoint_path, artifact_path)
+        print(f"Checkpoint load: {result['checkpoint_load_ms']:.1f} ms")
+        print(f"Artifact load:   {result['artifact_load_ms']:.1f} ms")
+        print(f"Max |logit diff|: {result['max_abs_logit_diff']:.2e}")
@@ -0,0 +1,311 @@
+"""
+Batched Grad-CAM explanations
+
+The output of the last features stage is captured with a forward hook and
+the class scores of a whole batch are differentiated with respect to it in a
+single backward pass. In eval mode every sample's score depends only on its
+own activations, so the gradient of the summed scores gives the per-sample
+gradients Grad-CAM needs. Heat maps are overlaid on the input images and
+written to compressed files by a background thread while the next batch is
+computed.
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from matplotlib import colormaps
+from PIL import Image
+from torch.utils.data import DataLoader, Subset
+
+import config
+from models import MODEL_BUILDERS
+from utils.checkpoint import load_model
+from utils.dataset import get_split_dataset
+from utils.transforms import get_val_transforms
+
+
+class BatchGradCAM:
+    """
+    Grad-CAM over a batch with one forward and one backward pass
+    
+    Model parameters are set to not require gradients while the explainer is
+    attached, and the hooked activations are made the only autograd leaf, so
+    the graph covers just the layers after the hook instead of the whole
+    backbone.
+    """
+    
+    def __init__(self, model, layer=None):
+        """
+        Args:
+            model: Classifier in eval mode
+            layer: Module whose output is explained (default: model.features[-1])
+        """
+        self.model = model
+        self.layer = layer if layer is not None else model.features[-1]
+        self.activations = None
+        self.requires_grad = [(p, p.requires_grad) for p in model.parameters()]
+        for param in model.parameters():
+            param.requires_grad_(False)
+        self.handle = self.layer.register_forward_hook(self._hook)
+    
+    def _hook(self, module, inputs, output):
+        if torch.is_grad_enabled():
+            output.requires_grad_()
+        self.activations = output
+    
+    def remove(self):
+        """Remove the forward hook and restore requires_grad on the parameters"""
+        self.handle.remove()
+        for param, requires_grad in self.requires_grad:
+            param.requires_grad_(requires_grad)
+    
+    def __call__(self, images, targets=None):
+        """
+        Compute class activation maps for a batch
+        
+        Args:
+            images: Normalized input batch [N, 3, H, W] on the model device
+            targets: Class index per image, or None for the predicted class
+        
+        Returns:
+            CAMs scaled to [0, 1] at input resolution [N, H, W], logits [N, num_classes]
+        """
+        with torch.enable_grad():
+            logits = self.model(images)
+            if targets is None:
+                targets = logits.argmax(dim=1)
+            scores = logits.gather(1, targets.view(-1, 1).to(logits.device)).sum()
+            grads, = torch.autograd.grad(scores, self.activations)
+        
+        activations = self.activations.detach()
+        self.activations = None
+        
+        weights = grads.mean(dim=(2, 3), keepdim=True)
+        cams = F.relu((weights * activations).sum(dim=1, keepdim=True))
+        cams = F.interpolate(cams, size=images.shape[-2:], mode='bilinear', align_corners=False).squeeze(1)
+        
+        flat = cams.flatten(1)
+        low = flat.min(dim=1).values.view(-1, 1, 1)
+        high = flat.max(dim=1).values.view(-1, 1, 1)
+        cams = (cams - low) / (high - low).clamp_min(1e-8)
+        return cams, logits.detach()
+
+
+def overlay(image, cam, alpha=0.4, cmap='jet'):
+    """
+    Blend a CAM over an image
+    
+    Args:
+        image: uint8 RGB array [H, W, 3]
+        cam: CAM in [0, 1] [H, W]
+        alpha: Heat map opacity
+        cmap: Matplotlib colormap name
+    
+    Returns:
+        uint8 RGB array [H, W, 3]
+    """
+    heat = colormaps[cmap](cam)[..., :3] * 255.0
+    return (image * (1.0 - alpha) + heat * alpha).astype(np.uint8)
+
+
+class CAMWriter:
+    """
+    Writes CAM overlays as JPEG files on a background thread
+    """
+    
+    def __init__(self, out_dir, quality=85, max_pending=4):
+        """
+        Args:
+            out_dir: Output directory
+            quality: JPEG quality
+            max_pending: Batches queued before compute waits for the writer
+        """
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.quality = quality
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = []
+        self.mean = np.array(config.MEAN, dtype=np.float32)
+        self.std = np.array(config.STD, dtype=np.float32)
+    
+    def _write(self, names, images, cams):
+        images = (images.transpose(0, 2, 3, 1) * self.std + self.mean).clip(0, 1) * 255.0
+        for name, image, cam in zip(names, images, cams):
+            Image.fromarray(overlay(image, cam)).save(self.out_dir / name, quality=self.quality)
+    
+    def submit(self, names, images, cams):
+        """
+        Queue a batch for writing
+        
+        Args:
+            names: Output file names
+            images: Normalized input batch [N, 3, H, W] (tensor)
+            cams: CAMs [N, H, W] (tensor)
+        """
+        self.pending.append(self.executor.submit(
+            self._write, names, images.cpu().numpy(), cams.cpu().numpy()
+        ))
+        while len(self.pending) > self.max_pending:
+            self.pending.pop(0).result()
+    
+    def close(self):
+        """Wait for all queued batches"""
+        for future in self.pending:
+            future.result()
+        self.pending = []
+        self.executor.shutdown()
+
+
+def explain_loader(cam, dataloader, device, target='predicted', writer=None, names=None):
+    """
+    Compute CAMs for every image of a DataLoader
+    
+    Args:
+        cam: BatchGradCAM
+        dataloader: DataLoader without shuffling
+        device: Device the model lives on
+        target: 'predicted' or 'true' class
+        writer: Optional CAMWriter for overlays
+        names: Output file name per dataset sample (required with a writer)
+    
+    Returns:
+        List of dictionaries with 'index', 'label', 'prediction', 'target'
+        and 'confidence'
+    """
+    if target not in ('predicted', 'true'):
+        raise ValueError(f"Target {target} not supported. Choose from ['predicted', 'true']")
+    
+    results = []
+    offset = 0
+    for images, labels in dataloader:
+        images = images.to(device, non_blocking=True)
+        targets = labels.to(device) if target == 'true' else None
+        cams, logits = cam(images, targets)
+        
+        probs = torch.softmax(logits, dim=1).cpu()
+        preds = probs.argmax(dim=1)
+        chosen = labels if target == 'true' else preds
+        for i in range(len(labels)):
+            results.append({
+                'index': offset + i,
+                'label': int(labels[i]),
+                'prediction': int(preds[i]),
+                'target': int(chosen[i]),
+                'confidence': float(probs[i, preds[i]]),
+            })
+        
+        if writer is not None:
+            writer.submit(names[offset:offset + len(labels)], images, cams)
+        offset += len(labels)
+    
+    if writer is not None:
+        writer.close()
+    return results
+
+
+def benchmark(cam, dataset, device, batch_size=32, num_images=256):
+    """
+    Throughput of batched Grad-CAM against one backward pass per image
+    
+    Args:
+        cam: BatchGradCAM
+        dataset: Dataset of normalized images
+        device: Device the model lives on
+        batch_size: Batch size of the batched run
+        num_images: Number of images timed
+    
+    Returns:
+        Dictionary with images/sec of both runs, the speedup and the maximum
+        difference between their CAMs
+    """
+    subset = Subset(dataset, range(min(num_images, len(dataset))))
+    images = torch.stack([subset[i][0] for i in range(len(subset))])
+    
+    def timed(size):
+        outputs = []
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        for i in range(0, len(images), size):
+            outputs.append(cam(images[i:i + size].to(device))[0].cpu())
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        return torch.cat(outputs), time.perf_counter() - start
+    
+    cam(images[:1].to(device))  # warm-up
+    batched, batched_time = timed(batch_size)
+    single, single_time = timed(1)
+    
+    return {
+        'num_images': len(images),
+        'batched_images_per_sec': len(images) / batched_time,
+        'per_image_images_per_sec': len(images) / single_time,
+        'speedup': single_time / batched_time,
+        'max_cam_diff': float((batched - single).abs().max()),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batched Grad-CAM explanations')
+    parser.add_argument('--model', type=str, default='efficientnet_b2',
+                        choices=list(MODEL_BUILDERS.keys()), help='Model architecture')
+    parser.add_argument('--split', type=str, default='test', choices=['train', 'val', 'test'],
+                        help='Dataset split to explain')
+    parser.add_argument('--target', type=str, default='predicted', choices=['predicted', 'true'],
+                        help='Class whose evidence is shown')
+    parser.add_argument('--batch_size', type=int, default=32, help='Batch size')
+    parser.add_argument('--output', type=str, default=None, help='Output directory')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Only compare batched and per-image throughput')
+    parser.add_argument('--benchmark_images', type=int, default=256,
+                        help='Number of images timed by --benchmark')
+    
+    args = parser.parse_args()
+    
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    img_size = config.MODEL_IMG_SIZES.get(args.model, config.IMG_SIZE)
+    model = load_model(args.model, device=device)
+    cam = BatchGradCAM(model)
+    
+    dataset = get_split_dataset(args.split, get_val_transforms(img_size), img_size)
+    
+    if args.benchmark:
+        results = benchmark(cam, dataset, device, args.batch_size, args.benchmark_images)
+        print(f"Batched:   {results['batched_images_per_sec']:.1f} images/sec")
+        print(f"Per image: {results['per_image_images_per_sec']:.1f} images/sec")
+        print(f"Speedup: {results['speedup']:.1f}x (max CAM diff {results['max_cam_diff']:.2e})")
+        
+        out_dir = config.EXPERIMENT_DIR / 'benchmarks'
+        out_dir.mkdir(parents=True, exist_ok=True)
+        with open(out_dir / f'gradcam_{args.model}.json', 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+    else:
+        out_dir = Path(args.output) if args.output else config.EXPERIMENT_DIR / args.model / 'gradcam' / args.split
+        loader = DataLoader(
+            dataset,
+            batch_size=args.batch_size,
+            shuffle=False,
+            num_workers=config.NUM_WORKERS,
+            pin_memory=device.type == 'cuda'
+        )
+        names = [f"{i:06d}_{Path(path).stem}.jpg" for i, (path, _) in enumerate(dataset.samples)]
+        
+        start = time.perf_counter()
+        results = explain_loader(cam, loader, device, args.target, CAMWriter(out_dir), names)
+        elapsed = time.perf_counter() - start
+        print(f"Explained {len(results)} images in {elapsed:.1f}s ({len(results) / elapsed:.1f} images/sec)")
+        
+        for result in results:
+            result['path'] = dataset.samples[result['index']][0]
+            result['file'] = names[result['index']]
+            result['prediction'] = config.CLASS_NAMES[result['prediction']]
+            result['label'] = config.CLASS_NAMES[result['label']]
+            result['target'] = config.CLASS_NAMES[result['target']]
+        with open(out_dir / 'explanations.json', 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,273 @@
+"""
+Incremental fine-tuning on newly added training images
+
+Starts from an existing checkpoint, finds training files added since the
+checkpoint's dataset snapshot, and fine-tunes on those files mixed with a
+bounded class-balanced replay sample of the old data. The update is only
+accepted if it does not regress on the validation split.
+"""
+import argparse
+import copy
+import random
+import shutil
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import torch
+import torch.optim as optim
+from torch.utils.data import DataLoader, Subset
+from sklearn.metrics import recall_score
+
+import config
+from models import get_model, MODEL_BUILDERS
+from train import set_seed, train_one_epoch
+from utils.checkpoint import get_checkpoint_path
+from utils.dataset import (
+    ZipImageDataset, dataset_snapshot, get_dataloaders, get_loader_kwargs, relative_sample_paths
+)
+from utils.focal_loss import FocalLoss
+from utils.logger import setup_logger
+from utils.metrics import evaluate_model
+
+
+def split_new_and_old(dataset, checkpoint, checkpoint_path):
+    """
+    Partition dataset indices into files added after the checkpoint and the rest
+    
+    Checkpoints without a dataset snapshot fall back to comparing file
+    modification times (for an archive, those of its zip entries) against
+    the checkpoint file.
+    
+    Args:
+        dataset: Training ImageFolder dataset or ZipImageDataset
+        checkpoint: Loaded checkpoint dictionary
+        checkpoint_path: Path of the checkpoint file
+    
+    Returns:
+        new_indices, old_indices
+    """
+    snapshot = checkpoint.get('dataset_snapshot')
+    
+    if snapshot is not None:
+        known = set(snapshot)
+        is_new = [path not in known for path in relative_sample_paths(dataset)]
+    else:
+        checkpoint_mtime = Path(checkpoint_path).stat().st_mtime
+        if isinstance(dataset, ZipImageDataset):
+            mtimes = dataset.modification_times()
+        else:
+            mtimes = [Path(path).stat().st_mtime for path, _ in dataset.samples]
+        is_new = [mtime > checkpoint_mtime for mtime in mtimes]
+    
+    new_indices = [i for i, new in enumerate(is_new) if new]
+    old_indices = [i for i, new in enumerate(is_new) if not new]
+    return new_indices, old_indices
+
+
+def sample_replay(dataset, old_indices, replay_size, seed=config.SEED):
+    """
+    Draw a class-balanced replay sample from previously seen data
+    
+    Args:
+        dataset: Training ImageFolder dataset
+        old_indices: Indices of previously seen samples
+        replay_size: Maximum total number of replay samples
+        seed: Random seed
+    
+    Returns:
+        List of replay indices
+    """
+    by_class = defaultdict(list)
+    for i in old_indices:
+        by_class[dataset.targets[i]].append(i)
+    
+    rng = random.Random(seed)
+    per_class = max(1, replay_size // max(len(by_class), 1))
+    replay = []
+    for indices in by_class.values():
+        replay.extend(rng.sample(indices, min(per_class, len(indices))))
+    return replay
+
+
+def _validation_scores(model, val_loader, device):
+    results = evaluate_model(model, val_loader, device, config.CLASS_NAMES)
+    per_class_recall = recall_score(
+        results['labels'], results['predictions'],
+        labels=list(range(config.NUM_CLASSES)), average=None, zero_division=0
+    )
+    return results['metrics'], per_class_recall
+
+
+def incremental_update(model_name, checkpoint_path=None, epochs=3, batch_size=32,
+                       lr=1e-4, gamma=2.0, replay_size=config.REPLAY_BUFFER_SIZE,
+                       max_regression=0.005, max_class_regression=0.05, promote=False):
+    """
+    Fine-tune a checkpoint on newly added images with replay
+    
+    Args:
+        model_name: Model architecture name
+        checkpoint_path: Starting checkpoint (default: best_model.pth)
+        epochs: Fine-tuning epochs
+        batch_size: Batch size
+        lr: Fine-tuning learning rate
+        gamma: Focal loss gamma
+        replay_size: Maximum number of old samples replayed
+        max_regression: Allowed drop in validation macro-F1
+        max_class_regression: Allowed drop in any single class's validation recall
+        promote: Overwrite best_model.pth if the update is accepted
+    
+    Returns:
+        Dictionary describing the update and whether it was accepted
+    """
+    if epochs < 1:
+        raise ValueError(f"epochs must be at least 1, got {epochs}")
+    
+    set_seed(config.SEED)
+    start_time = time.time()
+    
+    exp_dir = config.EXPERIMENT_DIR / model_name
+    checkpoint_dir = exp_dir / 'checkpoints'
+    logger = setup_logger(f'{model_name}_incremental', exp_dir / 'logs')
+    
+    if checkpoint_path is None:
+        checkpoint_path = get_checkpoint_path(model_name)
+    checkpoint_path = Path(checkpoint_path)
+    
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    img_size = config.MODEL_IMG_SIZES.get(model_name, config.IMG_SIZE)
+    
+    train_loader, val_loader, _, class_weights = get_dataloaders(
+        batch_size=batch_size,
+        num_workers=config.NUM_WORKERS,
+        img_size=img_size
+    )
+    train_dataset = train_loader.dataset
+    
+    checkpoint = torch.load(checkpoint_path, map_location=device, weights_only=False)
+    new_indices, old_indices = split_new_and_old(train_dataset, checkpoint, checkpoint_path)
+    logger.info(f"New training images since checkpoint: {len(new_indices)}")
+    
+    if not new_indices:
+        logger.info("Nothing to do.")
+        return {'accepted': False, 'new_samples': 0}
+    
+    replay_indices = sample_replay(train_dataset, old_indices, replay_size)
+    logger.info(f"Replay samples: {len(replay_indices)}")
+    
+    update_loader = DataLoader(
+        Subset(train_dataset, new_indices + replay_indices),
+        batch_size=batch_size,
+        shuffle=True,
+        **get_loader_kwargs(num_workers=config.NUM_WORKERS)
+    )
+    
+    model = get_model(model_name, num_classes=config.NUM_CLASSES, pretrained=False)
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model = model.to(device)
+    
+    base_metrics, base_recall = _validation_scores(model, val_loader, device)
+    base_f1 = base_metrics['f1_macro']
+    logger.info(f"Baseline Val F1: {base_f1:.4f}")
+    
+    criterion = FocalLoss(alpha=class_weights.to(device), gamma=gamma)
+    optimizer = optim.AdamW(model.parameters(), lr=lr, weight_decay=0.0001)
+    
+    best_f1 = -1.0
+    best_epoch = None
+    best_metrics = None
+    best_recall = None
+    best_state = None
+    for epoch in range(1, epochs + 1):
+        train_one_epoch(model, update_loader, criterion, optimizer, device, epoch, logger)
+        val_metrics, val_recall = _validation_scores(model, val_loader, device)
+        val_f1 = val_metrics['f1_macro']
+        logger.info(f"Epoch {epoch} - Val F1: {val_f1:.4f} (baseline {base_f1:.4f})")
+        if val_f1 > best_f1:
+            best_f1 = val_f1
+            best_epoch = epoch
+            best_metrics = val_metrics
+            best_recall = val_recall
+            best_state = copy.deepcopy(model.state_dict())
+    
+    # Regression check against the starting checkpoint
+    class_drops = base_recall - best_recall
+    regressed = [
+        (config.CLASS_NAMES[i], float(drop))
+        for i, drop in enumerate(class_drops) if drop > max_class_regression
+    ]
+    accepted = best_f1 >= base_f1 - max_regression and not regressed
+    
+    for name, drop in regressed:
+        logger.info(f"Regression on {name}: recall dropped by {drop:.4f}")
+    
+    summary = {
+        'accepted': accepted,
+        'new_samples': len(new_indices),
+        'replay_samples': len(replay_indices),
+        'base_f1_macro': float(base_f1),
+        'f1_macro': float(best_f1),
+        'best_epoch': best_epoch,
+        'class_regressions': regressed,
+        'minutes': (time.time() - start_time) / 60.0,
+    }
+    
+    if accepted:
+        output_path = checkpoint_dir / 'incremental_model.pth'
+        torch.save({
+            # Total epochs trained, and validation metrics of the fine-tuned weights
+            'epoch': (checkpoint.get('epoch') or 0) + best_epoch,
+            'model_state_dict': best_state,
+            'f1_macro': best_f1,
+            'metrics': best_metrics,
+            'dataset_snapshot': dataset_snapshot(train_dataset),
+            'base_checkpoint': str(checkpoint_path),
+            'incremental': summary,
+        }, output_path)
+        logger.info(f"✓ Update accepted and saved to {output_path}")
+        
+        if promote:
+            shutil.copyfile(output_path, checkpoint_dir / 'best_model.pth')
+            logger.info("✓ Promoted to best_model.pth")
+    else:
+        logger.info("✗ Update rejected: validation regression")
+    
+    logger.info(f"Incremental update took {summary['minutes']:.1f} minutes")
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incrementally fine-tune on newly added images')
+    parser.add_argument('--model', type=str, default='efficientnet_b2',
+                        choices=list(MODEL_BUILDERS.keys()), help='Model architecture')
+    parser.add_argument('--checkpoint', type=str, default=None,
+                        help='Starting checkpoint (default: best_model.pth)')
+    parser.add_argument('--epochs', type=int, default=3, help='Fine-tuning epochs')
+    parser.add_argument('--batch_size', type=int, default=32, help='Batch size')
+    parser.add_argument('--lr', type=float, default=1e-4, help='Learning rate')
+    parser.add_argument('--gamma', type=float, default=2.0, help='Focal loss gamma')
+    parser.add_argument('--replay_size', type=int, default=config.REPLAY_BUFFER_SIZE,
+                        help='Maximum number of old samples replayed')
+    parser.add_argument('--max_regression', type=float, default=0.005,
+                        help='Allowed drop in validation macro-F1')
+    parser.add_argument('--max_class_regression', type=float, default=0.05,
+                        help='Allowed drop in any single class recall')
+    parser.add_argument('--promote', action='store_true',
+                        help='Overwrite best_model.pth if the update is accepted')
+    
+    args = parser.parse_args()
+    if args.epochs < 1:
+        parser.error('--epochs must be at least 1')
+    
+    incremental_update(
+        model_name=args.model,
+        checkpoint_path=args.checkpoint,
+        epochs=args.epochs,
+        batch_size=args.batch_size,
+        lr=args.lr,
+        gamma=args.gamma,
+        replay_size=args.replay_size,
+        max_regression=args.max_regression,
+        max_class_regression=args.max_class_regression,
+        promote=args.promote
+    )
@@ -1,8 +1,27 @@
 """
 Model definitions for skin disease classification
 """
-from .efficientnet import get_efficientnet_b2
+from .efficientnet import get_efficientnet_b2, get_efficientnet_b3, get_efficientnet_b4
+
+MODEL_BUILDERS = {
+    'efficientnet_b2': get_efficientnet_b2,
+    'efficientnet_b3': get_efficientnet_b3,
+    'efficientnet_b4': get_efficientnet_b4,
+}
+
+
+def get_model(model_name, num_classes=22, pretrained=True):
+    """Get model by name"""
+    if model_name not in MODEL_BUILDERS:
+        raise ValueError(f"Model {model_name} not supported. Choose from {list(MODEL_BUILDERS.keys())}")
+    
+    return MODEL_BUILDERS[model_name](num_classes=num_classes, pretrained=pretrained)
+
 
 __all__ = [
     'get_efficientnet_b2',
+    'get_efficientnet_b3',
+    'get_efficientnet_b4',
+    'get_model',
+    'MODEL_BUILDERS',
 ]
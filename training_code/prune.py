@@ -0,0 +1,343 @@
+"""
+Structured channel pruning for EfficientNet-B2
+
+Expansion channels of every MBConv block are ranked by importance and
+physically removed (expand conv, depthwise conv, squeeze-excitation and
+projection are all rebuilt smaller), so the result is a genuinely smaller
+dense network. Each sparsity level is fine-tuned with the regular training
+loop and reported with parameters, FLOPs, CPU latency and test macro-F1.
+"""
+import argparse
+import copy
+import json
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torchvision.models.efficientnet import MBConv
+
+import config
+from models import get_model
+from train import set_seed, train_one_epoch, validate
+from utils.checkpoint import get_checkpoint_path, load_model
+from utils.dataset import get_dataloaders
+from utils.focal_loss import FocalLoss
+from utils.logger import setup_logger
+from utils.metrics import evaluate_model
+
+
+def _expansion_blocks(model):
+    """MBConv blocks that have an expansion stage (expand_ratio != 1)"""
+    return [
+        module for module in model.features.modules()
+        if isinstance(module, MBConv) and len(module.block) == 4
+    ]
+
+
+def _select_conv(conv, out_idx=None, in_idx=None):
+    """Build a smaller Conv2d from a subset of output and/or input channels"""
+    weight = conv.weight.data
+    if out_idx is not None:
+        weight = weight[out_idx]
+    if in_idx is not None and conv.groups == 1:
+        weight = weight[:, in_idx]
+    
+    out_channels = weight.shape[0]
+    depthwise = conv.groups > 1
+    in_channels = out_channels if depthwise else weight.shape[1] * conv.groups
+    
+    new_conv = nn.Conv2d(
+        in_channels, out_channels, conv.kernel_size,
+        stride=conv.stride, padding=conv.padding, dilation=conv.dilation,
+        groups=out_channels if depthwise else conv.groups,
+        bias=conv.bias is not None,
+        device=weight.device
+    )
+    new_conv.weight.data = weight.clone()
+    if conv.bias is not None:
+        bias = conv.bias.data
+        new_conv.bias.data = (bias[out_idx] if out_idx is not None else bias).clone()
+    return new_conv
+
+
+def _select_bn(bn, idx):
+    """Build a smaller BatchNorm2d from a subset of channels"""
+    new_bn = nn.BatchNorm2d(len(idx), eps=bn.eps, momentum=bn.momentum, device=bn.weight.device)
+    new_bn.weight.data = bn.weight.data[idx].clone()
+    new_bn.bias.data = bn.bias.data[idx].clone()
+    new_bn.running_mean = bn.running_mean[idx].clone()
+    new_bn.running_var = bn.running_var[idx].clone()
+    return new_bn
+
+
+def channel_importance(block, criterion='bn_l1'):
+    """
+    Score the expansion channels of an MBConv block
+    
+    Args:
+        block: MBConv block with an expansion stage
+        criterion: 'bn' (|gamma| of the depthwise BN), 'l1' (L1 norm of the
+            projection weights reading the channel) or 'bn_l1' (product)
+    
+    Returns:
+        Tensor of scores, one per expansion channel
+    """
+    depthwise_bn = block.block[1][1]
+    project_conv = block.block[3][0]
+    
+    bn_score = depthwise_bn.weight.data.abs()
+    l1_score = project_conv.weight.data.abs().sum(dim=(0, 2, 3))
+    
+    if criterion == 'bn':
+        return bn_score
+    if criterion == 'l1':
+        return l1_score
+    if criterion == 'bn_l1':
+        return bn_score * l1_score
+    raise ValueError(f"Criterion {criterion} not supported. Choose from ['bn', 'l1', 'bn_l1']")
+
+
+def prune_block(block, keep_idx):
+    """
+    Remove expansion channels from an MBConv block in place
+    
+    Args:
+        block: MBConv block with an expansion stage
+        keep_idx: Sorted indices of the expansion channels to keep
+    """
+    keep_idx = torch.as_tensor(keep_idx, dtype=torch.long, device=block.block[0][0].weight.device)
+    expand, depthwise, se, project = block.block
+    
+    expand[0] = _select_conv(expand[0], out_idx=keep_idx)
+    expand[1] = _select_bn(expand[1], keep_idx)
+    
+    depthwise[0] = _select_conv(depthwise[0], out_idx=keep_idx)
+    depthwise[1] = _select_bn(depthwise[1], keep_idx)
+    
+    se.fc1 = _select_conv(se.fc1, in_idx=keep_idx)
+    se.fc2 = _select_conv(se.fc2, out_idx=keep_idx)
+    
+    project[0] = _select_conv(project[0], in_idx=keep_idx)
+
+
+def _keep_count(channels, sparsity, multiple=8):
+    """Number of channels to keep, rounded to a hardware-friendly multiple"""
+    keep = int(round(channels * (1.0 - sparsity) / multiple)) * multiple
+    return max(multiple, min(channels, keep))
+
+
+def prune_model(model, sparsity, criterion='bn_l1'):
+    """
+    Prune the same fraction of expansion channels from every MBConv block
+    
+    Args:
+        model: EfficientNet model (modified in place)
+        sparsity: Fraction of expansion channels to remove
+        criterion: Importance criterion (see channel_importance)
+    
+    Returns:
+        List with the kept expansion width of every pruned block
+    """
+    widths = []
+    for block in _expansion_blocks(model):
+        scores = channel_importance(block, criterion)
+        keep = _keep_count(len(scores), sparsity)
+        keep_idx = torch.sort(torch.topk(scores, keep).indices).values
+        prune_block(block, keep_idx)
+        widths.append(keep)
+    return widths
+
+
+def build_pruned_model(model_name, widths):
+    """
+    Rebuild a pruned architecture so a saved state dict can be loaded
+    
+    Args:
+        model_name: Model architecture name
+        widths: Expansion widths saved alongside the pruned weights
+    
+    Returns:
+        Untrained model with the pruned shapes
+    """
+    model = get_model(model_name, num_classes=config.NUM_CLASSES, pretrained=False)
+    blocks = _expansion_blocks(model)
+    if len(blocks) != len(widths):
+        raise ValueError(f"Got {len(widths)} widths for {len(blocks)} expansion blocks")
+    for block, width in zip(blocks, widths):
+        prune_block(block, torch.arange(width))
+    return model
+
+
+def count_flops(model, img_size=config.IMG_SIZE):
+    """
+    Count multiply-accumulate operations of a single forward pass
+    
+    Args:
+        model: PyTorch model
+        img_size: Input resolution
+    
+    Returns:
+        Number of MACs for one image
+    """
+    total = [0]
+    
+    def conv_hook(module, inputs, output):
+        kernel = module.kernel_size[0] * module.kernel_size[1]
+        total[0] += output.numel() * (module.in_channels // module.groups) * kernel
+    
+    def linear_hook(module, inputs, output):
+        total[0] += output.numel() * module.in_features
+    
+    hooks = []
+    for module in model.modules():
+        if isinstance(module, nn.Conv2d):
+            hooks.append(module.register_forward_hook(conv_hook))
+        elif isinstance(module, nn.Linear):
+            hooks.append(module.register_forward_hook(linear_hook))
+    
+    device = next(model.parameters()).device
+    was_training = model.training
+    model.eval()
+    with torch.no_grad():
+        model(torch.zeros(1, 3, img_size, img_size, device=device))
+    model.train(was_training)
+    
+    for hook in hooks:
+        hook.remove()
+    
+    return total[0]
+
+
+def measure_cpu_latency(model, img_size=config.IMG_SIZE, runs=30, warmup=5):
+    """
+    Median single-image CPU latency in milliseconds
+    
+    Args:
+        model: PyTorch model (a CPU copy is timed)
+        img_size: Input resolution
+        runs: Number of timed runs
+        warmup: Number of untimed warmup runs
+    
+    Returns:
+        Median latency in ms
+    """
+    cpu_model = copy.deepcopy(model).cpu().eval()
+    x = torch.randn(1, 3, img_size, img_size)
+    timings = []
+    with torch.no_grad():
+        for i in range(warmup + runs):
+            start = time.perf_counter()
+            cpu_model(x)
+            if i >= warmup:
+                timings.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(timings))
+
+
+def sweep(model_name, sparsities, criterion='bn_l1', finetune_epochs=3,
+          batch_size=32, lr=1e-4, gamma=2.0):
+    """
+    Prune, fine-tune and evaluate the trained model at several sparsity levels
+    
+    Args:
+        model_name: Model architecture name (a best_model.pth is required)
+        sparsities: Fractions of expansion channels to remove
+        criterion: Importance criterion
+        finetune_epochs: Fine-tuning epochs per level
+        batch_size: Batch size
+        lr: Fine-tuning learning rate
+        gamma: Focal loss gamma
+    
+    Returns:
+        List of result rows, one per sparsity level (0.0 is the baseline)
+    """
+    set_seed(config.SEED)
+    
+    out_dir = config.EXPERIMENT_DIR / model_name / 'pruning'
+    out_dir.mkdir(parents=True, exist_ok=True)
+    logger = setup_logger(f'{model_name}_pruning', out_dir / 'logs')
+    
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    img_size = config.MODEL_IMG_SIZES.get(model_name, config.IMG_SIZE)
+    
+    train_loader, val_loader, test_loader, class_weights = get_dataloaders(
+        batch_size=batch_size,
+        num_workers=config.NUM_WORKERS,
+        img_size=img_size
+    )
+    criterion_fn = FocalLoss(alpha=class_weights.to(device), gamma=gamma)
+    
+    rows = []
+    for sparsity in [0.0] + [s for s in sparsities if s > 0]:
+        logger.info(f"\n{'='*50}")
+        logger.info(f"Sparsity {sparsity:.2f}")
+        logger.info(f"{'='*50}")
+        
+        model = load_model(model_name, get_checkpoint_path(model_name), device=device)
+        widths = None
+        if sparsity > 0:
+            widths = prune_model(model, sparsity, criterion)
+            optimizer = optim.AdamW(model.parameters(), lr=lr, weight_decay=0.0001)
+            for epoch in range(1, finetune_epochs + 1):
+                train_one_epoch(model, train_loader, criterion_fn, optimizer, device, epoch, logger)
+                validate(model, val_loader, criterion_fn, device, epoch, logger)
+            
+            torch.save({
+                'model_name': model_name,
+                'sparsity': sparsity,
+                'criterion': criterion,
+                'expansion_widths': widths,
+                'model_state_dict': model.state_dict(),
+            }, out_dir / f'pruned_{int(round(sparsity * 100))}.pth')
+        
+        results = evaluate_model(model, test_loader, device, config.CLASS_NAMES)
+        row = {
+            'sparsity': sparsity,
+            'params': sum(p.numel() for p in model.parameters()),
+            'gflops': count_flops(model, img_size) / 1e9,
+            'cpu_latency_ms': measure_cpu_latency(model, img_size),
+            'test_f1_macro': float(results['metrics']['f1_macro']),
+        }
+        rows.append(row)
+        logger.info(
+            f"Params: {row['params']:,}, GFLOPs: {row['gflops']:.3f}, "
+            f"CPU latency: {row['cpu_latency_ms']:.1f} ms, Test F1: {row['test_f1_macro']:.4f}"
+        )
+    
+    logger.info(f"\n{'Sparsity':>8} {'Params':>12} {'GFLOPs':>8} {'CPU ms':>8} {'Test F1':>8}")
+    for row in rows:
+        logger.info(f"{row['sparsity']:>8.2f} {row['params']:>12,} {row['gflops']:>8.3f} "
+                    f"{row['cpu_latency_ms']:>8.1f} {row['test_f1_macro']:>8.4f}")
+    
+    with open(out_dir / 'sweep.json', 'w') as f:
+        json.dump(rows, f, indent=2)
+    
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Structured channel pruning sweep')
+    parser.add_argument('--model', type=str, default='efficientnet_b2',
+                        choices=['efficientnet_b2'],
+                        help='Trained model to prune')
+    parser.add_argument('--sparsities', type=float, nargs='+', default=[0.25, 0.5, 0.75],
+                        help='Fractions of expansion channels to remove')
+    parser.add_argument('--criterion', type=str, default='bn_l1',
+                        choices=['bn', 'l1', 'bn_l1'], help='Channel importance criterion')
+    parser.add_argument('--finetune_epochs', type=int, default=3, help='Fine-tuning epochs per level')
+    parser.add_argument('--batch_size', type=int, default=32, help='Batch size')
+    parser.add_argument('--lr', type=float, default=1e-4, help='Fine-tuning learning rate')
+    parser.add_argument('--gamma', type=float, default=2.0, help='Focal loss gamma')
+    
+    args = parser.parse_args()
+    
+    sweep(
+        model_name=args.model,
+        sparsities=args.sparsities,
+        criterion=args.criterion,
+        finetune_epochs=args.finetune_epochs,
+        batch_size=args.batch_size,
+        lr=args.lr,
+        gamma=args.gamma
+    )
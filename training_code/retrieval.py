@@ -0,0 +1,263 @@
+"""
+Similar-case retrieval over training images
+
+Extracts the globally pooled penultimate features of a trained model for
+every image in TRAIN_DIR once, and builds an IVF-PQ index over them
+(utils.ann_index) so the most similar confirmed training cases for a query
+image are found in milliseconds. New training images can be added to an
+existing index without retraining it, and recall is measured against exact
+search over the stored features.
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset, Subset
+
+import config
+from models import MODEL_BUILDERS
+from utils.ann_index import IVFPQIndex, exact_search, recall_at_k
+from utils.checkpoint import load_model
+from utils.dataset import ImageLoader, get_split_dataset
+from utils.transforms import get_val_transforms
+
+
+class PathDataset(Dataset):
+    """Images from a list of paths with validation transforms"""
+    
+    def __init__(self, paths, img_size):
+        self.paths = [str(p) for p in paths]
+        self.transform = get_val_transforms(img_size)
+        self.loader = ImageLoader(img_size)
+    
+    def __len__(self):
+        return len(self.paths)
+    
+    def __getitem__(self, index):
+        return self.transform(self.loader(self.paths[index])), index
+
+
+def extract_features(model, dataloader, device):
+    """
+    Globally pooled penultimate features (the classifier input)
+    
+    Returns:
+        Features [N, D] (float32 numpy array)
+    """
+    features = []
+    with torch.no_grad():
+        for images, _ in dataloader:
+            x = model.features(images.to(device, non_blocking=True))
+            x = torch.flatten(model.avgpool(x), 1)
+            features.append(x.cpu().numpy())
+    return np.concatenate(features).astype(np.float32)
+
+
+class RetrievalIndex:
+    """
+    IVF-PQ index plus the training images it refers to
+    
+    The directory holds the index files, the image paths and labels
+    (items.json) and float16 copies of the raw features (features.npy) used
+    as ground truth for recall measurements.
+    """
+    
+    def __init__(self, index_dir, index, paths, labels, features):
+        self.index_dir = Path(index_dir)
+        self.index = index
+        self.paths = paths
+        self.labels = labels
+        self.features = features
+    
+    @classmethod
+    def build(cls, index_dir, features, paths, labels, nlist=None, m=16):
+        """
+        Train an index on the features and insert all of them
+        
+        Args:
+            index_dir: Output directory
+            features: Features [N, D]
+            paths: Image path per row
+            labels: Class index per row
+            nlist: Number of coarse lists (default: about 4 * sqrt(N))
+            m: Number of PQ sub-quantizers
+        
+        Returns:
+            RetrievalIndex
+        """
+        index = IVFPQIndex.train(features, nlist=nlist, m=m, seed=config.SEED)
+        index.add(features)
+        retrieval = cls(index_dir, index, list(paths), list(labels), features.astype(np.float16))
+        retrieval.save()
+        return retrieval
+    
+    @classmethod
+    def load(cls, index_dir):
+        """Open a saved index with memory-mapped codes and features"""
+        index_dir = Path(index_dir)
+        with open(index_dir / 'items.json', encoding='utf-8') as f:
+            items = json.load(f)
+        return cls(
+            index_dir,
+            IVFPQIndex.load(index_dir),
+            items['paths'],
+            items['labels'],
+            np.load(index_dir / 'features.npy', mmap_mode='r')
+        )
+    
+    def save(self):
+        """Write the index, items and features"""
+        self.index.save(self.index_dir)
+        tmp_path = self.index_dir / 'features.npy.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.features, dtype=np.float16))
+        os.replace(tmp_path, self.index_dir / 'features.npy')
+        with open(self.index_dir / 'items.json', 'w', encoding='utf-8') as f:
+            json.dump({'paths': self.paths, 'labels': self.labels}, f, ensure_ascii=False)
+    
+    def add(self, features, paths, labels):
+        """
+        Insert new images without retraining and save
+        
+        Args:
+            features: Features [N, D]
+            paths: Image path per row
+            labels: Class index per row
+        """
+        start = len(self.paths)
+        self.index.add(features, ids=np.arange(start, start + len(features)))
+        self.paths.extend(paths)
+        self.labels.extend(int(label) for label in labels)
+        self.features = np.concatenate([self.features, features.astype(np.float16)])
+        self.save()
+    
+    def query(self, features, k=5, nprobe=8):
+        """
+        Most similar indexed images per query
+        
+        Args:
+            features: Query features [Q, D]
+            k: Number of neighbours
+            nprobe: Coarse lists scanned per query
+        
+        Returns:
+            List (per query) of dictionaries with 'path', 'label' and 'similarity'
+        """
+        scores, ids = self.index.search(features, k=k, nprobe=nprobe)
+        return [
+            [
+                {'path': self.paths[i], 'label': self.labels[i], 'similarity': float(s)}
+                for s, i in zip(row_scores, row_ids) if i >= 0
+            ]
+            for row_scores, row_ids in zip(scores, ids)
+        ]
+    
+    def evaluate(self, queries, k=10, nprobes=(1, 4, 8, 16, 32)):
+        """
+        Recall against exact search and query latency
+        
+        Args:
+            queries: Query features [Q, D]
+            k: Number of neighbours
+            nprobes: nprobe values to measure
+        
+        Returns:
+            List of dictionaries with 'nprobe', 'recall' and 'ms_per_query'
+        """
+        _, exact_ids = exact_search(queries, np.asarray(self.features, dtype=np.float32), k=k)
+        results = []
+        for nprobe in nprobes:
+            start = time.perf_counter()
+            _, approx_ids = self.index.search(queries, k=k, nprobe=nprobe)
+            elapsed = time.perf_counter() - start
+            results.append({
+                'nprobe': nprobe,
+                'recall': recall_at_k(approx_ids, exact_ids),
+                'ms_per_query': 1000.0 * elapsed / len(queries),
+            })
+        return results
+
+
+def _loader(dataset, batch_size, device):
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=config.NUM_WORKERS,
+        pin_memory=device.type == 'cuda'
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Similar-case retrieval over training images')
+    parser.add_argument('command', choices=['build', 'add', 'evaluate', 'query'],
+                        help='build the index, add new training images, measure recall, or query images')
+    parser.add_argument('images', type=str, nargs='*', help='Query images (query command)')
+    parser.add_argument('--model', type=str, default='efficientnet_b2',
+                        choices=list(MODEL_BUILDERS.keys()), help='Model architecture')
+    parser.add_argument('--index_dir', type=str, default=None,
+                        help='Index directory (default: <experiment>/<model>/retrieval)')
+    parser.add_argument('--nlist', type=int, default=None, help='Number of coarse lists')
+    parser.add_argument('--m', type=int, default=16, help='Number of PQ sub-quantizers')
+    parser.add_argument('--k', type=int, default=5, help='Number of neighbours')
+    parser.add_argument('--nprobe', type=int, default=8, help='Coarse lists scanned per query')
+    parser.add_argument('--batch_size', type=int, default=64, help='Feature extraction batch size')
+    
+    args = parser.parse_args()
+    
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    img_size = config.MODEL_IMG_SIZES.get(args.model, config.IMG_SIZE)
+    index_dir = Path(args.index_dir) if args.index_dir else config.EXPERIMENT_DIR / args.model / 'retrieval'
+    model = load_model(args.model, device=device)
+    
+    if args.command in ('build', 'add'):
+        train_dataset = get_split_dataset('train', get_val_transforms(img_size), img_size)
+        indices = list(range(len(train_dataset)))
+        if args.command == 'add':
+            retrieval = RetrievalIndex.load(index_dir)
+            known = set(retrieval.paths)
+            indices = [i for i in indices if train_dataset.samples[i][0] not in known]
+            if not indices:
+                print("No new training images.")
+                raise SystemExit(0)
+        
+        paths = [train_dataset.samples[i][0] for i in indices]
+        labels = [train_dataset.samples[i][1] for i in indices]
+        start = time.perf_counter()
+        loader = _loader(Subset(train_dataset, indices), args.batch_size, device)
+        features = extract_features(model, loader, device)
+        print(f"Extracted {len(features)} features in {time.perf_counter() - start:.1f}s")
+        
+        start = time.perf_counter()
+        if args.command == 'build':
+            retrieval = RetrievalIndex.build(index_dir, features, paths, labels, nlist=args.nlist, m=args.m)
+        else:
+            retrieval.add(features, paths, labels)
+        print(f"✓ Index with {len(retrieval.paths)} images saved to {index_dir} "
+              f"({time.perf_counter() - start:.1f}s)")
+    
+    elif args.command == 'evaluate':
+        retrieval = RetrievalIndex.load(index_dir)
+        val_dataset = get_split_dataset('val', get_val_transforms(img_size), img_size)
+        queries = extract_features(model, _loader(val_dataset, args.batch_size, device), device)
+        
+        results = retrieval.evaluate(queries, k=args.k)
+        print(f"\n{'nprobe':>6} {'Recall@' + str(args.k):>10} {'ms/query':>9}")
+        for row in results:
+            print(f"{row['nprobe']:>6} {row['recall']:>10.4f} {row['ms_per_query']:>9.2f}")
+        
+        with open(index_dir / 'recall.json', 'w') as f:
+            json.dump({'args': vars(args), 'size': len(retrieval.paths), 'results': results}, f, indent=2)
+    
+    else:
+        retrieval = RetrievalIndex.load(index_dir)
+        queries = extract_features(model, _loader(PathDataset(args.images, img_size), args.batch_size, device), device)
+        for path, neighbours in zip(args.images, retrieval.query(queries, k=args.k, nprobe=args.nprobe)):
+            print(f"\n{path}")
+            for n in neighbours:
+                class_name = config.CLASS_NAMES[n['label']]
+                print(f"  {n['similarity']:.3f}  {class_name} ({config.CLASS_NAMES_TH[class_name]})  {n['path']}")
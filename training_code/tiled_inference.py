@@ -0,0 +1,279 @@
+"""
+Tiled high-resolution inference for large lesion photographs
+
+Instead of squashing a whole photograph to the model input size, each image
+is cut into overlapping tiles at one or more scales. Near-uniform background
+tiles are skipped with a cheap variance test, and tiles from many images are
+batched together through the classifier. Tile probabilities are aggregated
+into an image-level prediction and a coarse heat map of the predicted class.
+"""
+import argparse
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+from torchvision.datasets.folder import IMG_EXTENSIONS
+
+import config
+from models import MODEL_BUILDERS
+from utils.checkpoint import load_model
+
+
+def tile_positions(length, tile_size, stride):
+    """Start offsets covering [0, length) with the last tile flush to the edge"""
+    if length <= tile_size:
+        return [0]
+    positions = list(range(0, length - tile_size, stride))
+    positions.append(length - tile_size)
+    return positions
+
+
+class TiledImageDataset(Dataset):
+    """
+    Cuts each image into normalized tiles, dropping low-variance background
+    
+    Each item is a dictionary with the kept tiles, their (scale, row, col)
+    grid coordinates, the grid shape at every scale and a whole-image view.
+    """
+    
+    def __init__(self, paths, tile_size=config.IMG_SIZE, scales=(1.0,), overlap=0.25,
+                 max_side=config.TILE_MAX_SIDE, min_std=config.TILE_MIN_STD):
+        """
+        Args:
+            paths: Image paths
+            tile_size: Tile side length (the model input size)
+            scales: Scales (relative to the max_side-limited image) to tile at
+            overlap: Fraction of overlap between neighbouring tiles
+            max_side: Longest image side before tiling
+            min_std: Tiles whose grayscale standard deviation is below this are skipped
+        """
+        self.paths = [str(p) for p in paths]
+        self.tile_size = tile_size
+        self.scales = list(scales)
+        self.stride = max(1, int(round(tile_size * (1.0 - overlap))))
+        self.max_side = max_side
+        self.min_std = min_std
+        self.mean = torch.tensor(config.MEAN).view(3, 1, 1)
+        self.std = torch.tensor(config.STD).view(3, 1, 1)
+    
+    def __len__(self):
+        return len(self.paths)
+    
+    def _normalize(self, array):
+        tensor = torch.from_numpy(np.ascontiguousarray(array)).permute(2, 0, 1).float().div_(255)
+        return (tensor - self.mean) / self.std
+    
+    def __getitem__(self, index):
+        # Draft target with the image's aspect ratio: PIL picks the JPEG scale
+        # from the smaller side, so a square target would force a full decode
+        img = Image.open(self.paths[index])
+        fit = min(1.0, self.max_side / max(img.size))
+        if img.format == 'JPEG':
+            img.draft('RGB', (math.ceil(img.width * fit), math.ceil(img.height * fit)))
+        img = img.convert('RGB')
+        scale = min(1.0, self.max_side / max(img.size))
+        if scale < 1.0:
+            img = img.resize((round(img.width * scale), round(img.height * scale)), Image.BILINEAR)
+        
+        tiles = []
+        coords = []
+        grids = []
+        for scale_idx, s in enumerate(self.scales):
+            width = max(self.tile_size, round(img.width * s))
+            height = max(self.tile_size, round(img.height * s))
+            scaled = np.asarray(img.resize((width, height), Image.BILINEAR))
+            gray = scaled.mean(axis=2)
+            
+            rows = tile_positions(height, self.tile_size, self.stride)
+            cols = tile_positions(width, self.tile_size, self.stride)
+            grids.append((len(rows), len(cols)))
+            
+            for r, y in enumerate(rows):
+                for c, x in enumerate(cols):
+                    if gray[y:y + self.tile_size, x:x + self.tile_size].std() < self.min_std:
+                        continue
+                    tiles.append(self._normalize(scaled[y:y + self.tile_size, x:x + self.tile_size]))
+                    coords.append((scale_idx, r, c))
+        
+        whole = np.asarray(img.resize((self.tile_size, self.tile_size), Image.BILINEAR))
+        size = (0, 3, self.tile_size, self.tile_size)
+        return {
+            'index': index,
+            'tiles': torch.stack(tiles) if tiles else torch.empty(size),
+            'coords': coords,
+            'grids': grids,
+            'whole': self._normalize(whole),
+        }
+
+
+def collate_images(batch):
+    """Keep per-image items as a list; tiles are regrouped by the predictor"""
+    return batch
+
+
+def aggregate(tile_probs, whole_probs, method='mean'):
+    """
+    Combine tile probabilities into an image-level distribution
+    
+    Args:
+        tile_probs: Tile probabilities [T, num_classes] (T may be 0)
+        whole_probs: Whole-image probabilities [num_classes]
+        method: 'mean' (average of tiles and whole image), 'max' (per-class
+            maximum, renormalized) or 'confidence' (tiles weighted by their
+            top-1 probability)
+    
+    Returns:
+        Image-level probabilities [num_classes]
+    """
+    probs = torch.cat([tile_probs, whole_probs.unsqueeze(0)])
+    if method == 'mean':
+        return probs.mean(dim=0)
+    if method == 'max':
+        top = probs.max(dim=0).values
+        return top / top.sum()
+    if method == 'confidence':
+        weights = probs.max(dim=1).values
+        return (probs * weights.unsqueeze(1)).sum(dim=0) / weights.sum()
+    raise ValueError(f"Aggregation {method} not supported. Choose from ['mean', 'max', 'confidence']")
+
+
+class TiledPredictor:
+    """
+    Runs tiles from many images through the classifier in large batches
+    """
+    
+    def __init__(self, model, device='cpu', tile_batch_size=128, aggregation='mean'):
+        """
+        Args:
+            model: Classifier in eval mode
+            device: Device the model lives on
+            tile_batch_size: Number of tiles per forward pass
+            aggregation: Tile aggregation method (see aggregate)
+        """
+        self.model = model
+        self.device = torch.device(device)
+        self.tile_batch_size = tile_batch_size
+        self.aggregation = aggregation
+    
+    def _forward(self, tiles):
+        probs = []
+        with torch.no_grad():
+            for start in range(0, len(tiles), self.tile_batch_size):
+                batch = tiles[start:start + self.tile_batch_size].to(self.device, non_blocking=True)
+                probs.append(torch.softmax(self.model(batch), dim=1).cpu())
+        return torch.cat(probs) if probs else torch.empty(0, config.NUM_CLASSES)
+    
+    def predict(self, items):
+        """
+        Predict a group of images from TiledImageDataset items
+        
+        Returns:
+            List of dictionaries with 'index', 'probabilities', 'heatmaps'
+            (one [rows, cols] array per scale, NaN for skipped tiles) and
+            'num_tiles'
+        """
+        # One flat batch of every tile and whole-image view in the group
+        tiles = torch.cat([torch.cat([item['tiles'], item['whole'].unsqueeze(0)]) for item in items])
+        probs = self._forward(tiles)
+        
+        results = []
+        offset = 0
+        for item in items:
+            count = len(item['tiles'])
+            tile_probs = probs[offset:offset + count]
+            whole_probs = probs[offset + count]
+            offset += count + 1
+            
+            image_probs = aggregate(tile_probs, whole_probs, self.aggregation)
+            pred = int(image_probs.argmax())
+            
+            heatmaps = [np.full(grid, np.nan, dtype=np.float32) for grid in item['grids']]
+            for (scale_idx, r, c), p in zip(item['coords'], tile_probs[:, pred].numpy()):
+                heatmaps[scale_idx][r, c] = p
+            
+            results.append({
+                'index': item['index'],
+                'probabilities': image_probs.numpy(),
+                'heatmaps': heatmaps,
+                'num_tiles': count,
+            })
+        return results
+    
+    def predict_loader(self, dataloader):
+        """Predict every image of a DataLoader over a TiledImageDataset"""
+        results = []
+        for items in dataloader:
+            results.extend(self.predict(items))
+        return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tiled high-resolution inference')
+    parser.add_argument('inputs', type=str, nargs='+', help='Image files or directories')
+    parser.add_argument('--model', type=str, default='efficientnet_b2',
+                        choices=list(MODEL_BUILDERS.keys()), help='Model architecture')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 0.5],
+                        help='Tiling scales relative to the size-limited image')
+    parser.add_argument('--overlap', type=float, default=0.25, help='Tile overlap fraction')
+    parser.add_argument('--aggregation', type=str, default='mean',
+                        choices=['mean', 'max', 'confidence'], help='Tile aggregation')
+    parser.add_argument('--images_per_batch', type=int, default=8,
+                        help='Images whose tiles are batched together')
+    parser.add_argument('--tile_batch_size', type=int, default=128, help='Tiles per forward pass')
+    parser.add_argument('--output', type=str, default=None, help='Output directory')
+    
+    args = parser.parse_args()
+    
+    paths = []
+    for item in args.inputs:
+        item = Path(item)
+        if item.is_dir():
+            paths.extend(sorted(p for p in item.rglob('*') if p.suffix.lower() in IMG_EXTENSIONS))
+        else:
+            paths.append(item)
+    
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model = load_model(args.model, device=device)
+    img_size = config.MODEL_IMG_SIZES.get(args.model, config.IMG_SIZE)
+    
+    dataset = TiledImageDataset(paths, tile_size=img_size, scales=args.scales, overlap=args.overlap)
+    loader = DataLoader(
+        dataset,
+        batch_size=args.images_per_batch,
+        shuffle=False,
+        num_workers=config.NUM_WORKERS,
+        collate_fn=collate_images
+    )
+    predictor = TiledPredictor(
+        model, device=device, tile_batch_size=args.tile_batch_size, aggregation=args.aggregation
+    )
+    results = predictor.predict_loader(loader)
+    
+    out_dir = Path(args.output) if args.output else config.EXPERIMENT_DIR / args.model / 'tiled'
+    out_dir.mkdir(parents=True, exist_ok=True)
+    
+    summary = []
+    for result in results:
+        path = paths[result['index']]
+        pred = int(result['probabilities'].argmax())
+        class_name = config.CLASS_NAMES[pred]
+        print(f"{path}: {class_name} ({config.CLASS_NAMES_TH[class_name]}) "
+              f"{result['probabilities'][pred]:.4f} [{result['num_tiles']} tiles]")
+        
+        np.savez_compressed(
+            out_dir / f"{result['index']:06d}_{Path(path).stem}_heatmap.npz",
+            *result['heatmaps']
+        )
+        summary.append({
+            'path': str(path),
+            'prediction': class_name,
+            'confidence': float(result['probabilities'][pred]),
+            'num_tiles': result['num_tiles'],
+        })
+    
+    with open(out_dir / 'predictions.json', 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
@@ -12,14 +12,24 @@ import random
 import numpy as np
 from tqdm import tqdm
 import time
+from collections import deque
 
 import config
-from models import get_efficientnet_b2
-from utils.dataset import get_dataloaders
-from utils.metrics import calculate_metrics
-from utils.visualization import plot_training_history, plot_confusion_matrix
+from models import get_model, MODEL_BUILDERS
+from utils.dataset import get_dataloaders, dataset_snapshot
+from utils.loader_tuning import autotune_for_training
+from utils.metrics import calculate_metrics, evaluate_model
+from utils.reporting import ReportWorker
 from utils.logger import setup_logger
 from utils.focal_loss import FocalLoss
+from utils.freezing import (
+    enable_staged_freezing,
+    update_frozen_blocks,
+    build_discriminative_optimizer,
+    trainable_parameter_count,
+    optimizer_state_bytes,
+    parse_unfreeze_schedule
+)
 
 
 def set_seed(seed=42):
@@ -33,18 +43,6 @@ def set_seed(seed=42):
     torch.backends.cudnn.benchmark = False
 
 
-def get_model(model_name, num_classes=22, pretrained=True):
-    """Get model by name"""
-    models_dict = {
-        'efficientnet_b2': get_efficientnet_b2,
-    }
-    
-    if model_name not in models_dict:
-        raise ValueError(f"Model {model_name} not supported. Choose from {list(models_dict.keys())}")
-    
-    return models_dict[model_name](num_classes=num_classes, pretrained=pretrained)
-
-
 def train_one_epoch(model, dataloader, criterion, optimizer, device, epoch, logger):
     """Train for one epoch"""
     model.train()
@@ -87,6 +85,129 @@ def train_one_epoch(model, dataloader, criterion, optimizer, device, epoch, logg
     return epoch_loss, metrics
 
 
+def train_one_epoch_selective(model, dataloader, criterion, optimizer, device, epoch, logger,
+                              keep_fraction=0.5, selection='loss', loss_history=None,
+                              beta=None, refill=True):
+    """
+    Train for one epoch, backpropagating only the hardest samples
+    
+    Every batch first gets a cheap no-grad scoring pass (in eval mode, so
+    BatchNorm statistics are not updated twice). Only the selected samples
+    are forwarded again with gradients and backpropagated.
+    
+    Args:
+        model: PyTorch model
+        dataloader: Training DataLoader
+        criterion: FocalLoss used for training
+        optimizer: Optimizer
+        device: Device to train on
+        epoch: Epoch number (for logging)
+        logger: Logger
+        keep_fraction: Fraction of samples to backpropagate, in (0, 1]; exact
+            per batch for 'loss' selection, the expected rate for 'history'
+        selection: 'loss' keeps the top keep_fraction of each batch by loss;
+            'history' keeps each sample with probability equal to its loss
+            percentile among recent losses raised to beta
+        loss_history: deque of recent per-sample losses, shared across epochs
+            ('history' selection)
+        beta: Selectivity exponent for 'history' selection (default: chosen
+            so the expected keep rate, 1 / (beta + 1), equals keep_fraction)
+        refill: Accumulate selected samples until a full batch is available
+            before each optimizer step, instead of stepping on partial batches
+    
+    Returns:
+        epoch_loss, metrics, number of backpropagated samples
+    """
+    if not 0 < keep_fraction <= 1:
+        raise ValueError(f"keep_fraction must be in (0, 1], got {keep_fraction}")
+    if beta is None:
+        beta = 1.0 / keep_fraction - 1.0
+    
+    per_sample_criterion = FocalLoss(alpha=criterion.alpha, gamma=criterion.gamma, reduction='none')
+    if loss_history is None:
+        loss_history = deque(maxlen=config.SELECTIVE_BACKPROP_HISTORY)
+    
+    running_loss = 0.0
+    all_preds = []
+    all_labels = []
+    pending_images = []
+    pending_labels = []
+    num_backprop = 0
+    
+    def step(images, labels):
+        model.train()
+        optimizer.zero_grad()
+        loss = criterion(model(images), labels)
+        loss.backward()
+        optimizer.step()
+        return loss.item()
+    
+    pbar = tqdm(dataloader, desc=f'Epoch {epoch} [Train SB]')
+    for images, labels in pbar:
+        images = images.to(device)
+        labels = labels.to(device)
+        
+        # Cheap scoring pass
+        model.eval()
+        with torch.no_grad():
+            outputs = model(images)
+            losses = per_sample_criterion(outputs, labels)
+        
+        running_loss += losses.sum().item()
+        all_preds.extend(outputs.argmax(dim=1).cpu().numpy())
+        all_labels.extend(labels.cpu().numpy())
+        
+        # Select hard samples
+        if selection == 'loss':
+            k = max(1, int(round(keep_fraction * len(losses))))
+            selected = torch.topk(losses, k).indices
+        elif selection == 'history':
+            batch_losses = losses.cpu().numpy()
+            loss_history.extend(batch_losses.tolist())
+            history = np.sort(np.fromiter(loss_history, dtype=np.float32))
+            percentile = np.searchsorted(history, batch_losses, side='right') / len(history)
+            keep = np.random.rand(len(batch_losses)) < percentile ** beta
+            selected = torch.from_numpy(np.nonzero(keep)[0]).to(device)
+        else:
+            raise ValueError(f"Selection {selection} not supported. Choose from ['loss', 'history']")
+        
+        if len(selected) == 0:
+            continue
+        
+        if not refill:
+            step(images[selected], labels[selected])
+            num_backprop += len(selected)
+            continue
+        
+        # Refill: queue selected samples and step on full batches only
+        pending_images.append(images[selected])
+        pending_labels.append(labels[selected])
+        queued = sum(len(x) for x in pending_labels)
+        if queued >= dataloader.batch_size:
+            queue_images = torch.cat(pending_images)
+            queue_labels = torch.cat(pending_labels)
+            batch = dataloader.batch_size
+            loss = step(queue_images[:batch], queue_labels[:batch])
+            num_backprop += batch
+            pending_images = [queue_images[batch:]]
+            pending_labels = [queue_labels[batch:]]
+            pbar.set_postfix({'loss': loss})
+    
+    # Flush remaining queued samples
+    if refill and sum(len(x) for x in pending_labels) > 0:
+        step(torch.cat(pending_images), torch.cat(pending_labels))
+        num_backprop += sum(len(x) for x in pending_labels)
+    
+    # Calculate epoch metrics
+    epoch_loss = running_loss / len(dataloader.dataset)
+    metrics = calculate_metrics(all_labels, all_preds)
+    
+    logger.info(f"Train - Loss: {epoch_loss:.4f}, Acc: {metrics['accuracy']:.4f}, F1: {metrics['f1_macro']:.4f}, "
+                f"Backprop: {num_backprop}/{len(dataloader.dataset)}")
+    
+    return epoch_loss, metrics, num_backprop
+
+
 def validate(model, dataloader, criterion, device, epoch, logger):
     """Validate model"""
     model.eval()
@@ -122,7 +243,10 @@ def validate(model, dataloader, criterion, device, epoch, logger):
     return epoch_loss, metrics
 
 
-def train(model_name, epochs=30, batch_size=32, lr=0.001, gamma=2.0):
+def train(model_name, epochs=30, batch_size=32, lr=0.001, gamma=2.0,
+          autotune=False, autotune_batch_sizes=None, selective_backprop=None,
+          selection='loss', sb_beta=None, sb_refill=True, target_f1=None,
+          unfreeze_schedule=None):
     """Main training function"""
     
     # Set seed
@@ -150,30 +274,60 @@ def train(model_name, epochs=30, batch_size=32, lr=0.001, gamma=2.0):
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     logger.info(f"Using device: {device}")
     
-    # Get dataloaders
-    logger.info("Loading datasets...")
-    train_loader, val_loader, test_loader, class_weights = get_dataloaders(
-        batch_size=batch_size,
-        num_workers=config.NUM_WORKERS
-    )
-    
     # Create model
     logger.info(f"Creating model: {model_name}")
     model = get_model(model_name, num_classes=config.NUM_CLASSES, pretrained=True)
     model = model.to(device)
     
-    # Count parameters
-    total_params = sum(p.numel() for p in model.parameters())
-    trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
-    logger.info(f"Total parameters: {total_params:,}")
-    logger.info(f"Trainable parameters: {trainable_params:,}")
+    img_size = config.MODEL_IMG_SIZES.get(model_name, config.IMG_SIZE)
+    
+    # DataLoader settings, optionally auto-tuned for this host
+    loader_settings = {'num_workers': config.NUM_WORKERS}
+    if autotune:
+        logger.info("Auto-tuning DataLoader settings...")
+        tuned = autotune_for_training(
+            model=model,
+            device=device,
+            img_size=img_size,
+            batch_sizes=autotune_batch_sizes,
+            logger=logger
+        )
+        batch_size = tuned['batch_size']
+        torch.set_num_threads(tuned['num_threads'])
+        loader_settings = {
+            'num_workers': tuned['num_workers'],
+            'pin_memory': tuned['pin_memory'],
+            'persistent_workers': tuned['persistent_workers'],
+            'prefetch_factor': tuned['prefetch_factor'],
+        }
+        logger.info(f"Batch size: {batch_size}, torch threads: {tuned['num_threads']}, "
+                    f"DataLoader: {loader_settings}")
+    
+    # Get dataloaders
+    logger.info("Loading datasets...")
+    train_loader, val_loader, test_loader, class_weights = get_dataloaders(
+        batch_size=batch_size,
+        img_size=img_size,
+        **loader_settings
+    )
+    snapshot = dataset_snapshot(train_loader.dataset)
     
     # Setup loss function
     criterion = FocalLoss(alpha=class_weights.to(device), gamma=gamma)
     logger.info(f"Using Focal Loss with gamma={gamma}")
     
     # Setup optimizer
-    optimizer = optim.AdamW(model.parameters(), lr=lr, weight_decay=0.0001)
+    if unfreeze_schedule:
+        enable_staged_freezing(model, unfreeze_schedule)
+        optimizer = build_discriminative_optimizer(model, lr=lr, weight_decay=0.0001)
+        logger.info(f"Staged unfreezing schedule: {unfreeze_schedule}")
+    else:
+        optimizer = optim.AdamW(model.parameters(), lr=lr, weight_decay=0.0001)
+    
+    # Count parameters (after the first epoch's blocks are frozen)
+    total_params = sum(p.numel() for p in model.parameters())
+    logger.info(f"Total parameters: {total_params:,}")
+    logger.info(f"Trainable parameters: {trainable_parameter_count(model):,}")
     
     # Setup scheduler
     scheduler = optim.lr_scheduler.ReduceLROnPlateau(
@@ -183,6 +337,9 @@ def train(model_name, epochs=30, batch_size=32, lr=0.001, gamma=2.0):
     # Setup TensorBoard
     writer = SummaryWriter(log_dir=log_dir)
     
+    # Setup background report rendering
+    reporter = ReportWorker(results_dir, quality=config.REPORT_QUALITY)
+    
     # Training history
     history = {
         'train_loss': [],
@@ -190,9 +347,20 @@ def train(model_name, epochs=30, batch_size=32, lr=0.001, gamma=2.0):
         'train_acc': [],
         'val_acc': [],
         'train_f1': [],
-        'val_f1': []
+        'val_f1': [],
+        'epoch_time': []
     }
     
+    # Selective backpropagation state
+    loss_history = deque(maxlen=config.SELECTIVE_BACKPROP_HISTORY)
+    if selective_backprop is not None:
+        logger.info(f"Selective backprop: selection={selection}, keep_fraction={selective_backprop}, "
+                    f"beta={sb_beta if sb_beta is not None else 'auto'}, refill={sb_refill}")
+    
+    # Wall-clock training time, excluding validation
+    train_time = 0.0
+    time_to_target = None
+    
     # Training loop
     best_f1 = 0.0
     best_loss = float('inf')
@@ -204,10 +372,28 @@ def train(model_name, epochs=30, batch_size=32, lr=0.001, gamma=2.0):
         logger.info(f"Epoch {epoch}/{epochs}")
         logger.info(f"{'='*50}")
         
+        # Unfreeze earlier blocks on schedule
+        if unfreeze_schedule and update_frozen_blocks(model, unfreeze_schedule, epoch):
+            logger.info(f"Unfroze features[{model.features.num_frozen}:]")
+            logger.info(f"Trainable parameters: {trainable_parameter_count(model):,}")
+        
+        if device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(device)
+        
         # Train
-        train_loss, train_metrics = train_one_epoch(
-            model, train_loader, criterion, optimizer, device, epoch, logger
-        )
+        epoch_start = time.time()
+        if selective_backprop is not None:
+            train_loss, train_metrics, _ = train_one_epoch_selective(
+                model, train_loader, criterion, optimizer, device, epoch, logger,
+                keep_fraction=selective_backprop, selection=selection,
+                loss_history=loss_history, beta=sb_beta, refill=sb_refill
+            )
+        else:
+            train_loss, train_metrics = train_one_epoch(
+                model, train_loader, criterion, optimizer, device, epoch, logger
+            )
+        epoch_time = time.time() - epoch_start
+        train_time += epoch_time
         
         # Validate
         val_loss, val_metrics = validate(
@@ -224,6 +410,18 @@ def train(model_name, epochs=30, batch_size=32, lr=0.001, gamma=2.0):
         history['val_acc'].append(val_metrics['accuracy'])
         history['train_f1'].append(train_metrics['f1_macro'])
         history['val_f1'].append(val_metrics['f1_macro'])
+        history['epoch_time'].append(epoch_time)
+        
+        logger.info(f"Epoch time: {epoch_time:.1f}s, total training time: {train_time:.1f}s")
+        logger.info(f"Optimizer state: {optimizer_state_bytes(optimizer) / 1024 ** 2:.1f} MB")
+        if device.type == 'cuda':
+            peak_memory = torch.cuda.max_memory_allocated(device) / 1024 ** 2
+            logger.info(f"Peak GPU memory: {peak_memory:.1f} MB")
+            writer.add_scalar('Memory/peak_mb', peak_memory, epoch)
+        writer.add_scalar('Time/epoch_s', epoch_time, epoch)
+        if target_f1 is not None and time_to_target is None and val_metrics['f1_macro'] >= target_f1:
+            time_to_target = train_time
+            logger.info(f"Reached target Val F1 {target_f1:.4f} after {time_to_target:.1f}s of training")
         
         # Log to TensorBoard
         writer.add_scalar('Loss/train', train_loss, epoch)
@@ -234,6 +432,9 @@ def train(model_name, epochs=30, batch_size=32, lr=0.001, gamma=2.0):
         writer.add_scalar('F1/val', val_metrics['f1_macro'], epoch)
         writer.add_scalar('LR', optimizer.param_groups[0]['lr'], epoch)
         
+        # Refresh report plots without blocking training
+        reporter.submit_history(history)
+        
         # Save best model
         if val_metrics['f1_macro'] > best_f1:
             best_f1 = val_metrics['f1_macro']
@@ -242,7 +443,8 @@ def train(model_name, epochs=30, batch_size=32, lr=0.001, gamma=2.0):
                 'model_state_dict': model.state_dict(),
                 'optimizer_state_dict': optimizer.state_dict(),
                 'f1_macro': best_f1,
-                'metrics': val_metrics
+                'metrics': val_metrics,
+                'dataset_snapshot': snapshot
             }, checkpoint_dir / 'best_model.pth')
             logger.info(f"✓ Best model saved! F1: {best_f1:.4f}")
         
@@ -263,11 +465,22 @@ def train(model_name, epochs=30, batch_size=32, lr=0.001, gamma=2.0):
         'epoch': epoch,
         'model_state_dict': model.state_dict(),
         'optimizer_state_dict': optimizer.state_dict(),
-        'metrics': val_metrics
+        'metrics': val_metrics,
+        'dataset_snapshot': snapshot
     }, checkpoint_dir / 'final_model.pth')
     
     # Plot training history
-    plot_training_history(history, save_path=results_dir / 'training_history.png')
+    reporter.submit_history(history, quality=config.FINAL_REPORT_QUALITY)
+    
+    # Plot confusion matrix and per-class metrics of the final model
+    val_results = evaluate_model(model, val_loader, device, config.CLASS_NAMES)
+    reporter.submit_evaluation(
+        val_results['confusion_matrix'],
+        config.CLASS_NAMES,
+        metrics=val_results['metrics'],
+        per_class=val_results['per_class'],
+        quality=config.FINAL_REPORT_QUALITY
+    )
     
     # Save history
     import json
@@ -275,8 +488,14 @@ def train(model_name, epochs=30, batch_size=32, lr=0.001, gamma=2.0):
         json.dump(history, f, indent=2)
     
     writer.close()
+    reporter.close()
     logger.info("Training completed!")
     logger.info(f"Best F1 Score: {best_f1:.4f}")
+    if target_f1 is not None:
+        if time_to_target is not None:
+            logger.info(f"Time to target F1 {target_f1:.4f}: {time_to_target:.1f}s")
+        else:
+            logger.info(f"Target F1 {target_f1:.4f} not reached")
     
     return model, history
 
@@ -284,19 +503,48 @@ def train(model_name, epochs=30, batch_size=32, lr=0.001, gamma=2.0):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Train skin disease classification model')
     parser.add_argument('--model', type=str, default='efficientnet_b2',
-                        choices=['efficientnet_b2'],
+                        choices=list(MODEL_BUILDERS.keys()),
                         help='Model architecture to train')
     parser.add_argument('--epochs', type=int, default=30, help='Number of epochs')
     parser.add_argument('--batch_size', type=int, default=32, help='Batch size')
     parser.add_argument('--lr', type=float, default=0.001, help='Learning rate')
     parser.add_argument('--gamma', type=float, default=2.0, help='Focal loss gamma')
+    parser.add_argument('--autotune', action='store_true',
+                        help='Auto-tune DataLoader settings for this host (cached per host)')
+    parser.add_argument('--selective_backprop', type=float, default=None,
+                        help='Backpropagate only this fraction of the hardest samples, in (0, 1]')
+    parser.add_argument('--selection', type=str, default='loss', choices=['loss', 'history'],
+                        help='Hard-sample selection: per-batch top loss or loss-history percentile')
+    parser.add_argument('--sb_beta', type=float, default=None,
+                        help="Selectivity exponent for --selection history "
+                             "(default: matches --selective_backprop as the expected keep rate)")
+    parser.add_argument('--no_refill', action='store_true',
+                        help='Step on the selected samples of each batch instead of refilling full batches')
+    parser.add_argument('--target_f1', type=float, default=None,
+                        help='Report wall-clock training time to reach this Val F1')
+    parser.add_argument('--unfreeze_schedule', type=str, nargs='?', default=None,
+                        const=config.UNFREEZE_SCHEDULE,
+                        help="Staged unfreezing as 'epoch:first_trainable_block,...' "
+                             f"(flag alone uses '{config.UNFREEZE_SCHEDULE}')")
+    parser.add_argument('--autotune_batch_sizes', type=int, nargs='+', default=None,
+                        help='Batch sizes the auto-tuner may choose from (default: --batch_size)')
     
     args = parser.parse_args()
+    if args.selective_backprop is not None and not 0 < args.selective_backprop <= 1:
+        parser.error('--selective_backprop must be in (0, 1]')
     
     train(
         model_name=args.model,
         epochs=args.epochs,
         batch_size=args.batch_size,
         lr=args.lr,
-        gamma=args.gamma
+        gamma=args.gamma,
+        autotune=args.autotune,
+        autotune_batch_sizes=args.autotune_batch_sizes or [args.batch_size],
+        selective_backprop=args.selective_backprop,
+        selection=args.selection,
+        sb_beta=args.sb_beta,
+        sb_refill=not args.no_refill,
+        target_f1=args.target_f1,
+        unfreeze_schedule=parse_unfreeze_schedule(args.unfreeze_schedule) if args.unfreeze_schedule else None
     )
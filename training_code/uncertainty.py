@@ -0,0 +1,272 @@
+"""
+Head-only Monte Carlo dropout uncertainty
+
+The only dropout in the EfficientNet models is classifier[0], applied to the
+globally pooled features. The backbone is therefore deterministic at
+inference: it runs once per image, the pooled features are replicated T
+times and dropout masks for all T samples are applied in a single batched
+operation before the final linear layer. This gives the same predictive
+distribution as T full MC-dropout passes at close to single-forward cost.
+
+Referral thresholds on the uncertainty scores are calibrated on the
+validation split so that the retained predictions reach a target accuracy.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+
+import config
+from models import MODEL_BUILDERS
+from utils.checkpoint import load_model
+from utils.dataset import get_split_dataset
+from utils.transforms import get_val_transforms
+
+SCORES = ('entropy', 'mutual_information')
+
+
+class MCDropoutHead:
+    """
+    Samples the dropout classifier head T times on one backbone pass
+    """
+    
+    def __init__(self, model, num_samples=30, seed=None):
+        """
+        Args:
+            model: EfficientNet model with classifier = [Dropout, Linear]
+            num_samples: Number of dropout samples T
+            seed: Optional seed for reproducible dropout masks
+        """
+        self.model = model
+        self.num_samples = num_samples
+        self.p = model.classifier[0].p
+        self.linear = model.classifier[1]
+        self.generator = None
+        if seed is not None:
+            device = next(model.parameters()).device
+            self.generator = torch.Generator(device=device).manual_seed(seed)
+    
+    def pooled_features(self, images):
+        """Globally pooled backbone features [N, D]"""
+        x = self.model.features(images)
+        x = self.model.avgpool(x)
+        return torch.flatten(x, 1)
+    
+    def sample_probs(self, features):
+        """
+        Class probabilities of every dropout sample
+        
+        Args:
+            features: Pooled features [N, D]
+        
+        Returns:
+            Probabilities [T, N, num_classes]
+        """
+        shape = (self.num_samples,) + tuple(features.shape)
+        keep = torch.empty(shape, device=features.device, dtype=features.dtype)
+        keep.bernoulli_(1.0 - self.p, generator=self.generator)
+        dropped = features.unsqueeze(0) * keep / (1.0 - self.p)
+        return torch.softmax(F.linear(dropped, self.linear.weight, self.linear.bias), dim=-1)
+    
+    def __call__(self, images):
+        """
+        Predictive distribution and uncertainty for a batch
+        
+        Args:
+            images: Normalized input batch [N, 3, H, W]
+        
+        Returns:
+            Dictionary of tensors: 'probabilities' (mean over samples),
+            'entropy' (of the mean), 'mutual_information' (entropy minus
+            expected sample entropy) and 'deterministic' (probabilities
+            without dropout)
+        """
+        with torch.no_grad():
+            features = self.pooled_features(images)
+            samples = self.sample_probs(features)
+            deterministic = torch.softmax(self.linear(features), dim=1)
+        
+        mean = samples.mean(dim=0)
+        entropy = -(mean * torch.log(mean.clamp_min(1e-12))).sum(dim=1)
+        expected_entropy = -(samples * torch.log(samples.clamp_min(1e-12))).sum(dim=2).mean(dim=0)
+        
+        return {
+            'probabilities': mean,
+            'entropy': entropy,
+            'mutual_information': (entropy - expected_entropy).clamp_min(0.0),
+            'deterministic': deterministic,
+        }
+
+
+def collect_uncertainty(head, dataloader, device):
+    """
+    Run the MC-dropout head over a dataset
+    
+    Returns:
+        Dictionary of numpy arrays: 'probabilities', 'entropy',
+        'mutual_information' and 'labels'
+    """
+    outputs = {key: [] for key in ('probabilities', 'entropy', 'mutual_information', 'labels')}
+    for images, labels in dataloader:
+        result = head(images.to(device, non_blocking=True))
+        for key in ('probabilities', 'entropy', 'mutual_information'):
+            outputs[key].append(result[key].cpu().numpy())
+        outputs['labels'].append(labels.numpy())
+    return {key: np.concatenate(values) for key, values in outputs.items()}
+
+
+def calibrate_threshold(scores, correct, target_accuracy):
+    """
+    Highest uncertainty threshold whose retained predictions reach the target accuracy
+    
+    Samples with a score above the threshold are referred for review.
+    
+    Args:
+        scores: Uncertainty score per sample (higher is less certain)
+        correct: Boolean correctness per sample
+        target_accuracy: Required accuracy of the retained samples
+    
+    Returns:
+        Dictionary with the threshold, referral rate and retained accuracy
+    """
+    # Retaining the k most certain samples gives accuracy from cumulative sums
+    order = np.argsort(scores, kind='stable')
+    sorted_scores = scores[order]
+    n = len(scores)
+    retained_correct = np.cumsum(correct[order])
+    accuracy = retained_correct / np.arange(1, n + 1)
+    
+    valid = np.ones(n, dtype=bool)
+    valid[:-1] = sorted_scores[1:] > sorted_scores[:-1]
+    ok = np.nonzero(valid & (accuracy >= target_accuracy))[0]
+    
+    if len(ok) == 0:
+        return {'threshold': float('-inf'), 'referral_rate': 1.0, 'retained_accuracy': float('nan')}
+    
+    k = int(ok[-1]) + 1
+    threshold = float(sorted_scores[k - 1]) if k == n else float((sorted_scores[k - 1] + sorted_scores[k]) / 2)
+    return {
+        'threshold': threshold,
+        'referral_rate': 1.0 - k / n,
+        'retained_accuracy': float(accuracy[k - 1]),
+    }
+
+
+def referral_report(outputs, thresholds):
+    """
+    Referral rate and retained accuracy for calibrated thresholds
+    
+    Args:
+        outputs: Result of collect_uncertainty
+        thresholds: Dictionary of score name to threshold
+    
+    Returns:
+        Dictionary of score name to statistics
+    """
+    correct = outputs['probabilities'].argmax(axis=1) == outputs['labels']
+    report = {'accuracy': float(correct.mean())}
+    for score, threshold in thresholds.items():
+        retained = outputs[score] <= threshold
+        report[score] = {
+            'threshold': threshold,
+            'referral_rate': float(1.0 - retained.mean()),
+            'retained_accuracy': float(correct[retained].mean()) if retained.any() else float('nan'),
+            'referred_accuracy': float(correct[~retained].mean()) if (~retained).any() else float('nan'),
+        }
+    return report
+
+
+def benchmark(head, dataloader, device, max_batches=10):
+    """
+    Latency of the MC-dropout head against a single deterministic forward pass
+    
+    Returns:
+        Dictionary with ms/image of both and their ratio
+    """
+    batches = []
+    for images, _ in dataloader:
+        batches.append(images.to(device))
+        if len(batches) == max_batches:
+            break
+    num_images = sum(len(images) for images in batches)
+    
+    def timed(fn):
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        with torch.no_grad():
+            for images in batches:
+                fn(images)
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        return 1000.0 * (time.perf_counter() - start) / num_images
+    
+    head.model(batches[0])  # warm-up
+    single_ms = timed(head.model)
+    mc_ms = timed(head)
+    return {
+        'single_forward_ms': single_ms,
+        'mc_dropout_ms': mc_ms,
+        'overhead': mc_ms / single_ms,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calibrate head-only MC-dropout uncertainty')
+    parser.add_argument('--model', type=str, default='efficientnet_b2',
+                        choices=list(MODEL_BUILDERS.keys()), help='Model architecture')
+    parser.add_argument('--num_samples', type=int, default=30, help='Dropout samples T')
+    parser.add_argument('--target_accuracy', type=float, default=0.95,
+                        help='Required accuracy of predictions that are not referred')
+    parser.add_argument('--batch_size', type=int, default=32, help='Batch size')
+    
+    args = parser.parse_args()
+    
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    img_size = config.MODEL_IMG_SIZES.get(args.model, config.IMG_SIZE)
+    model = load_model(args.model, device=device)
+    head = MCDropoutHead(model, num_samples=args.num_samples, seed=config.SEED)
+    
+    def make_loader(split):
+        return DataLoader(
+            get_split_dataset(split, get_val_transforms(img_size), img_size),
+            batch_size=args.batch_size,
+            shuffle=False,
+            num_workers=config.NUM_WORKERS,
+            pin_memory=device.type == 'cuda'
+        )
+    
+    print("Calibrating on validation split...")
+    val = collect_uncertainty(head, make_loader('val'), device)
+    val_correct = val['probabilities'].argmax(axis=1) == val['labels']
+    calibration = {
+        score: calibrate_threshold(val[score], val_correct, args.target_accuracy)
+        for score in SCORES
+    }
+    for score, result in calibration.items():
+        print(f"{score}: threshold {result['threshold']:.4f}, "
+              f"Val referral rate {result['referral_rate']:.2%}, "
+              f"retained accuracy {result['retained_accuracy']:.4f}")
+    
+    print("Evaluating on test split...")
+    test_loader = make_loader('test')
+    test = collect_uncertainty(head, test_loader, device)
+    report = referral_report(test, {score: result['threshold'] for score, result in calibration.items()})
+    print(f"Test accuracy: {report['accuracy']:.4f}")
+    for score in SCORES:
+        print(f"{score}: referral rate {report[score]['referral_rate']:.2%}, "
+              f"retained accuracy {report[score]['retained_accuracy']:.4f}")
+    
+    timing = benchmark(head, test_loader, device)
+    print(f"Latency - single forward: {timing['single_forward_ms']:.2f} ms/image, "
+          f"MC-dropout (T={args.num_samples}): {timing['mc_dropout_ms']:.2f} ms/image "
+          f"({timing['overhead']:.2f}x)")
+    
+    out_dir = config.EXPERIMENT_DIR / args.model / 'results'
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / 'uncertainty.json', 'w') as f:
+        json.dump({'args': vars(args), 'calibration': calibration, 'test': report, 'timing': timing}, f, indent=2)
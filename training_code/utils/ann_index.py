@@ -0,0 +1,302 @@
+"""
+Approximate nearest-neighbour index in pure numpy
+
+An inverted-file index with product quantization (IVF-PQ). Vectors are
+assigned to the nearest of nlist coarse k-means centroids, and the residual
+to that centroid is split into m sub-vectors that are each encoded as one
+byte (the nearest of 256 sub-centroids). A query only scans the lists of its
+nprobe nearest centroids and scores their codes with per-list lookup tables.
+
+Codes are stored grouped by list so each list is a contiguous slice. The
+index is saved as .npy files and opened with memory mapping, so several
+processes can serve queries from the same pages.
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+def squared_distances(x, centroids):
+    """Squared L2 distances [N, K] between rows of x and centroids"""
+    return (
+        (x * x).sum(axis=1, keepdims=True)
+        - 2.0 * x @ centroids.T
+        + (centroids * centroids).sum(axis=1)
+    )
+
+
+def assign(x, centroids, chunk_size=8192):
+    """Index of the nearest centroid for every row of x"""
+    labels = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), chunk_size):
+        labels[start:start + chunk_size] = squared_distances(x[start:start + chunk_size], centroids).argmin(axis=1)
+    return labels
+
+
+def kmeans(x, k, n_iter=20, seed=0):
+    """
+    Lloyd's k-means
+    
+    Args:
+        x: Training vectors [N, D] (float32)
+        k: Number of centroids (at most N)
+        n_iter: Iterations
+        seed: Random seed
+    
+    Returns:
+        Centroids [k, D]
+    """
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = assign(x, centroids)
+        counts = np.bincount(labels, minlength=k)
+        nonempty = counts > 0
+        # Per-cluster sums over vectors sorted by cluster
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.add.reduceat(x[np.argsort(labels, kind='stable')], starts[nonempty], axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+        # Re-seed empty clusters with random training vectors
+        empty = np.nonzero(~nonempty)[0]
+        if len(empty):
+            centroids[empty] = x[rng.choice(len(x), size=len(empty), replace=False)]
+    return centroids
+
+
+def normalize(x):
+    """L2-normalize rows so that L2 ranking equals cosine ranking"""
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+class IVFPQIndex:
+    """
+    Inverted-file index over product-quantized, L2-normalized vectors
+    """
+    
+    def __init__(self, coarse, codebooks):
+        """
+        Args:
+            coarse: Coarse centroids [nlist, D]
+            codebooks: PQ sub-centroids [m, 256, D // m]
+        """
+        self.coarse = coarse
+        self.codebooks = codebooks
+        self.nlist = len(coarse)
+        self.m, self.ksub, self.dsub = codebooks.shape
+        self.codebook_norms = (codebooks * codebooks).sum(axis=2)
+        
+        self.codes = np.empty((0, self.m), dtype=np.uint8)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+    
+    @classmethod
+    def train(cls, vectors, nlist=None, m=16, n_iter=20, max_train=50000, seed=0):
+        """
+        Learn coarse centroids and PQ codebooks
+        
+        Args:
+            vectors: Training vectors [N, D]
+            nlist: Number of coarse lists (default: about 4 * sqrt(N))
+            m: Number of sub-quantizers (must divide D)
+            n_iter: k-means iterations
+            max_train: Maximum number of vectors used for training
+            seed: Random seed
+        
+        Returns:
+            Empty index (call add to insert vectors)
+        """
+        vectors = normalize(vectors)
+        n, dim = vectors.shape
+        if dim % m:
+            raise ValueError(f"Dimension {dim} is not divisible by m={m}")
+        
+        rng = np.random.default_rng(seed)
+        if n > max_train:
+            vectors = vectors[rng.choice(n, size=max_train, replace=False)]
+            n = max_train
+        
+        if nlist is None:
+            nlist = int(4 * np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+        coarse = kmeans(vectors, nlist, n_iter, seed)
+        
+        residuals = vectors - coarse[assign(vectors, coarse)]
+        dsub = dim // m
+        ksub = min(256, n)
+        codebooks = np.zeros((m, 256, dsub), dtype=np.float32)
+        for j in range(m):
+            codebooks[j, :ksub] = kmeans(residuals[:, j * dsub:(j + 1) * dsub], ksub, n_iter, seed + j + 1)
+        return cls(coarse, codebooks)
+    
+    def encode(self, vectors):
+        """
+        Coarse list and PQ codes of vectors
+        
+        Returns:
+            List assignments [N], codes [N, m] (uint8)
+        """
+        vectors = normalize(vectors)
+        lists = assign(vectors, self.coarse)
+        residuals = vectors - self.coarse[lists]
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = residuals[:, j * self.dsub:(j + 1) * self.dsub]
+            codes[:, j] = assign(sub, self.codebooks[j])
+        return lists, codes
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def add(self, vectors, ids=None):
+        """
+        Insert vectors without retraining
+        
+        Existing codes are merged with the new ones and regrouped by list.
+        
+        Args:
+            vectors: Vectors [N, D]
+            ids: Integer ids (default: consecutive after the current maximum)
+        """
+        if ids is None:
+            start = int(self.ids.max()) + 1 if len(self.ids) else 0
+            ids = np.arange(start, start + len(vectors), dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+        
+        new_lists, new_codes = self.encode(vectors)
+        old_lists = np.repeat(np.arange(self.nlist), np.diff(self.offsets))
+        
+        lists = np.concatenate([old_lists, new_lists])
+        order = np.argsort(lists, kind='stable')
+        self.codes = np.concatenate([self.codes, new_codes])[order]
+        self.ids = np.concatenate([self.ids, ids])[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=self.nlist))])
+    
+    def search(self, queries, k=10, nprobe=8):
+        """
+        Approximate top-k neighbours
+        
+        Args:
+            queries: Query vectors [Q, D]
+            k: Number of neighbours
+            nprobe: Number of coarse lists scanned per query
+        
+        Returns:
+            Cosine similarities [Q, k] (estimated from the codes) and ids
+            [Q, k]; missing neighbours have id -1
+        """
+        queries = normalize(queries)
+        nprobe = min(nprobe, self.nlist)
+        probes = np.argsort(squared_distances(queries, self.coarse), axis=1)[:, :nprobe]
+        sub_index = np.arange(self.m)
+        
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for qi, (query, lists) in enumerate(zip(queries, probes)):
+            # Lookup tables of squared sub-distances per probed list [nprobe, m, 256]
+            residuals = (query - self.coarse[lists]).reshape(len(lists), self.m, self.dsub)
+            tables = (
+                (residuals * residuals).sum(axis=2, keepdims=True)
+                - 2.0 * np.einsum('pmd,mkd->pmk', residuals, self.codebooks)
+                + self.codebook_norms
+            )
+            
+            slices = [np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists]
+            rows = np.concatenate(slices)
+            if not len(rows):
+                continue
+            table_index = np.repeat(np.arange(len(lists)), [len(s) for s in slices])
+            codes = np.asarray(self.codes[rows])
+            distances = tables[table_index[:, None], sub_index, codes].sum(axis=1)
+            
+            top = min(k, len(rows))
+            best = np.argpartition(distances, top - 1)[:top]
+            best = best[np.argsort(distances[best])]
+            all_scores[qi, :top] = 1.0 - distances[best] / 2.0
+            all_ids[qi, :top] = self.ids[rows[best]]
+        return all_scores, all_ids
+    
+    def save(self, index_dir):
+        """
+        Write the index as .npy files
+        
+        Files are written under temporary names and then renamed. On POSIX
+        systems, processes that have the previous version memory-mapped keep
+        a valid mapping; on Windows the rename fails while another process
+        has the file mapped.
+        
+        Args:
+            index_dir: Output directory
+        """
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        for name in ('coarse', 'codebooks', 'codes', 'ids', 'offsets'):
+            tmp_path = index_dir / f'{name}.npy.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.ascontiguousarray(getattr(self, name)))
+            os.replace(tmp_path, index_dir / f'{name}.npy')
+        with open(index_dir / 'index.json', 'w') as f:
+            json.dump({
+                'format_version': FORMAT_VERSION,
+                'nlist': self.nlist,
+                'm': self.m,
+                'dim': int(self.coarse.shape[1]),
+                'size': len(self),
+            }, f, indent=2)
+    
+    @classmethod
+    def load(cls, index_dir, mmap=True):
+        """
+        Open a saved index
+        
+        Args:
+            index_dir: Directory written by save
+            mmap: Memory-map the codes and ids instead of reading them
+        
+        Returns:
+            IVFPQIndex
+        """
+        index_dir = Path(index_dir)
+        with open(index_dir / 'index.json') as f:
+            info = json.load(f)
+        if info.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format in {index_dir}: {info.get('format_version')}")
+        
+        mode = 'r' if mmap else None
+        index = cls(np.load(index_dir / 'coarse.npy'), np.load(index_dir / 'codebooks.npy'))
+        index.codes = np.load(index_dir / 'codes.npy', mmap_mode=mode)
+        index.ids = np.load(index_dir / 'ids.npy', mmap_mode=mode)
+        index.offsets = np.load(index_dir / 'offsets.npy')
+        return index
+
+
+def exact_search(queries, vectors, k=10, chunk_size=4096):
+    """
+    Brute-force cosine top-k, used as ground truth for recall
+    
+    Returns:
+        Similarities [Q, k] and row indices [Q, k] into vectors
+    """
+    queries = normalize(queries)
+    vectors = normalize(vectors)
+    k = min(k, len(vectors))
+    scores = np.empty((len(queries), k), dtype=np.float32)
+    indices = np.empty((len(queries), k), dtype=np.int64)
+    for start in range(0, len(queries), chunk_size):
+        sims = queries[start:start + chunk_size] @ vectors.T
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        indices[start:start + chunk_size] = np.take_along_axis(top, order, axis=1)
+        scores[start:start + chunk_size] = np.take_along_axis(top_sims, order, axis=1)
+    return scores, indices
+
+
+def recall_at_k(approx_ids, exact_ids):
+    """Mean fraction of the exact top-k found by the approximate search"""
+    hits = [len(set(a) & set(e)) for a, e in zip(approx_ids.tolist(), exact_ids.tolist())]
+    return float(np.mean(hits)) / exact_ids.shape[1]
@@ -0,0 +1,130 @@
+"""
+Checkpoint loading utilities for inference
+"""
+import json
+from pathlib import Path
+
+import torch
+
+import config
+from models import get_model
+
+
+def get_checkpoint_path(model_name, name='best_model.pth'):
+    """
+    Get the default checkpoint path of a model
+    
+    Args:
+        model_name: Model architecture name
+        name: Checkpoint file name
+    
+    Returns:
+        Path to the checkpoint
+    """
+    return config.EXPERIMENT_DIR / model_name / 'checkpoints' / name
+
+
+def load_model(model_name, checkpoint_path=None, device='cpu'):
+    """
+    Build a model and load trained weights for inference
+    
+    Args:
+        model_name: Model architecture name
+        checkpoint_path: Path to the checkpoint (default: best_model.pth)
+        device: Device to load the model onto
+    
+    Returns:
+        Model in eval mode
+    """
+    if checkpoint_path is None:
+        checkpoint_path = get_checkpoint_path(model_name)
+    checkpoint_path = Path(checkpoint_path)
+    
+    model = get_model(model_name, num_classes=config.NUM_CLASSES, pretrained=False)
+    checkpoint = torch.load(checkpoint_path, map_location=device, weights_only=False)
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model = model.to(device)
+    model.eval()
+    
+    return model
+
+
+ARTIFACT_FORMAT = 'skin-disease-weights-v1'
+
+
+def export_artifact(model_name, checkpoint_path=None, output_path=None):
+    """
+    Export a weights-only deployment artifact from a training checkpoint
+    
+    The artifact drops optimizer state and stores only the model weights and
+    the metadata needed to serve them (class names, Thai names, image size,
+    normalization and source metrics). A JSON copy of the metadata is
+    written next to it.
+    
+    Args:
+        model_name: Model architecture name
+        checkpoint_path: Source checkpoint (default: best_model.pth)
+        output_path: Artifact path (default: <checkpoints>/<model_name>.weights.pt)
+    
+    Returns:
+        Path of the written artifact
+    """
+    if checkpoint_path is None:
+        checkpoint_path = get_checkpoint_path(model_name)
+    checkpoint_path = Path(checkpoint_path)
+    if output_path is None:
+        output_path = checkpoint_path.parent / f'{model_name}.weights.pt'
+    output_path = Path(output_path)
+    
+    checkpoint = torch.load(checkpoint_path, map_location='cpu', weights_only=False)
+    state_dict = {k: v.contiguous() for k, v in checkpoint['model_state_dict'].items()}
+    
+    metrics = checkpoint.get('metrics') or {}
+    metadata = {
+        'format': ARTIFACT_FORMAT,
+        'model_name': model_name,
+        'num_classes': config.NUM_CLASSES,
+        'class_names': list(config.CLASS_NAMES),
+        'class_names_th': dict(config.CLASS_NAMES_TH),
+        'img_size': config.MODEL_IMG_SIZES.get(model_name, config.IMG_SIZE),
+        'mean': list(config.MEAN),
+        'std': list(config.STD),
+        'epoch': checkpoint.get('epoch'),
+        'metrics': {k: float(v) for k, v in metrics.items()},
+        'source_checkpoint': checkpoint_path.name,
+    }
+    
+    torch.save({'metadata': metadata, 'state_dict': state_dict}, output_path)
+    with open(output_path.with_suffix('.json'), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    
+    return output_path
+
+
+def load_artifact(artifact_path, device='cpu'):
+    """
+    Load a deployment artifact through memory mapping
+    
+    Weights are memory-mapped instead of read into process memory, so
+    workers loading the same file share its pages, and the model is built on
+    the meta device so no time is spent on random initialization.
+    
+    Args:
+        artifact_path: Path written by export_artifact
+        device: Device to run on ('cpu' keeps the memory-mapped weights)
+    
+    Returns:
+        Model in eval mode, metadata dictionary
+    """
+    artifact = torch.load(artifact_path, map_location='cpu', mmap=True, weights_only=True)
+    metadata = artifact['metadata']
+    if metadata.get('format') != ARTIFACT_FORMAT:
+        raise ValueError(f"{artifact_path} is not a deployment artifact (format {metadata.get('format')})")
+    
+    with torch.device('meta'):
+        model = get_model(metadata['model_name'], num_classes=metadata['num_classes'], pretrained=False)
+    model.load_state_dict(artifact['state_dict'], assign=True)
+    model = model.to(device)
+    model.eval()
+    
+    return model, metadata
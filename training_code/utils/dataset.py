@@ -1,69 +1,168 @@
 """
 Dataset loader for skin disease images
 """
+import io
+import json
+import os
+import time
+import zipfile
 import torch
-from torch.utils.data import DataLoader
+from torch.utils.data import Dataset, DataLoader
+from torchvision import transforms
 from torchvision.datasets import ImageFolder
+from torchvision.datasets.folder import IMG_EXTENSIONS
 from collections import Counter
+from pathlib import Path, PurePosixPath
 import numpy as np
+from PIL import Image
 
 import config
 from utils.transforms import get_train_transforms, get_val_transforms
 
 
-def get_dataloaders(batch_size=config.BATCH_SIZE, num_workers=config.NUM_WORKERS):
+def open_image(fp, target_size=None):
+    """
+    Decode an image to RGB, using reduced-resolution JPEG decoding if possible
+    
+    For JPEG files the decoder is asked for the smallest DCT scale (1/2, 1/4
+    or 1/8) that is still at least target_size on both sides, so large
+    camera images are never fully decoded only to be resized. Other formats
+    are decoded at full resolution.
+    
+    Args:
+        fp: File path or file object
+        target_size: (width, height) the image will be resized to, or None
+            for a full decode
+    
+    Returns:
+        RGB PIL image
+    """
+    img = Image.open(fp)
+    if target_size is not None and img.format == 'JPEG':
+        img.draft('RGB', tuple(target_size))
+    return img.convert('RGB')
+
+
+class ImageLoader:
+    """
+    Picklable ImageFolder loader that decodes JPEGs close to the target size
+    """
+    
+    def __init__(self, img_size=config.IMG_SIZE, fast_decode=config.FAST_JPEG_DECODE):
+        """
+        Args:
+            img_size: Size the image is resized to by the transforms
+            fast_decode: Use reduced-resolution JPEG decoding
+        """
+        self.target_size = (img_size, img_size) if fast_decode else None
+    
+    def __call__(self, path):
+        with open(path, 'rb') as f:
+            return open_image(f, self.target_size)
+
+
+def get_loader_kwargs(num_workers=config.NUM_WORKERS, pin_memory=None,
+                      persistent_workers=False, prefetch_factor=None):
+    """
+    Build DataLoader keyword arguments that are valid for the worker count
+    
+    Args:
+        num_workers: Number of worker processes for data loading
+        pin_memory: Pin host memory (default: only when CUDA is available)
+        persistent_workers: Keep workers alive between epochs
+        prefetch_factor: Batches prefetched per worker (default: PyTorch's)
+    
+    Returns:
+        Dictionary of DataLoader keyword arguments
+    """
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    
+    kwargs = {
+        'num_workers': num_workers,
+        'pin_memory': pin_memory,
+    }
+    
+    # Worker-only options are rejected by DataLoader when num_workers == 0
+    if num_workers > 0:
+        kwargs['persistent_workers'] = persistent_workers
+        if prefetch_factor is not None:
+            kwargs['prefetch_factor'] = prefetch_factor
+    
+    return kwargs
+
+
+def get_dataloaders(batch_size=config.BATCH_SIZE, num_workers=config.NUM_WORKERS,
+                    img_size=config.IMG_SIZE, pin_memory=None, persistent_workers=False,
+                    prefetch_factor=None, archive=config.DATA_ARCHIVE):
     """
     Create train, validation, and test dataloaders
     
     Args:
         batch_size: Batch size for dataloaders
         num_workers: Number of worker processes for data loading
+        img_size: Target image size
+        pin_memory: Pin host memory (default: only when CUDA is available)
+        persistent_workers: Keep workers alive between epochs
+        prefetch_factor: Batches prefetched per worker (default: PyTorch's)
+        archive: Dataset zip archive to read all splits from instead of the
+            extracted directories (default: config.DATA_ARCHIVE)
     
     Returns:
         train_loader, val_loader, test_loader, class_weights
     """
     # Create datasets
-    train_dataset = ImageFolder(
-        root=str(config.TRAIN_DIR),
-        transform=get_train_transforms()
-    )
-    
-    val_dataset = ImageFolder(
-        root=str(config.VAL_DIR),
-        transform=get_val_transforms()
-    )
-    
-    test_dataset = ImageFolder(
-        root=str(config.TEST_DIR),
-        transform=get_val_transforms()
-    )
+    if archive is not None:
+        train_dataset, val_dataset, test_dataset = get_archive_datasets(archive, img_size)
+    else:
+        train_dataset = ImageFolder(
+            root=str(config.TRAIN_DIR),
+            transform=get_train_transforms(img_size),
+            loader=ImageLoader(img_size)
+        )
+        
+        val_dataset = ImageFolder(
+            root=str(config.VAL_DIR),
+            transform=get_val_transforms(img_size),
+            loader=ImageLoader(img_size)
+        )
+        
+        test_dataset = ImageFolder(
+            root=str(config.TEST_DIR),
+            transform=get_val_transforms(img_size),
+            loader=ImageLoader(img_size)
+        )
     
     # Calculate class weights for handling imbalance
     class_weights = calculate_class_weights(train_dataset)
     
     # Create dataloaders
+    loader_kwargs = get_loader_kwargs(
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        persistent_workers=persistent_workers,
+        prefetch_factor=prefetch_factor
+    )
+    
     train_loader = DataLoader(
         train_dataset,
         batch_size=batch_size,
         shuffle=True,
-        num_workers=num_workers,
-        pin_memory=True
+        **loader_kwargs
     )
     
     val_loader = DataLoader(
         val_dataset,
         batch_size=batch_size,
         shuffle=False,
-        num_workers=num_workers,
-        pin_memory=True
+        **loader_kwargs
     )
     
     test_loader = DataLoader(
         test_dataset,
         batch_size=batch_size,
         shuffle=False,
-        num_workers=num_workers,
-        pin_memory=True
+        **loader_kwargs
     )
     
     print(f"Train samples: {len(train_dataset)}")
@@ -103,3 +202,286 @@ def calculate_class_weights(dataset):
         print(f"  {class_name}: {weight:.4f} (samples: {class_counts[i]})")
     
     return weights
+
+
+class SharedDecodeDataset(Dataset):
+    """
+    ImageFolder variant that returns a single uint8 decode per image
+    
+    The decode is resized once to the largest resolution needed by any
+    consumer (e.g. ensemble members or cascade stages); smaller views are
+    derived from it on the device with resize_normalize_batch.
+    """
+    
+    def __init__(self, split, img_size):
+        """
+        Args:
+            split: 'train', 'val' or 'test' (read from DATA_ARCHIVE if set)
+            img_size: Resolution of the shared decode
+        """
+        self.folder = get_split_dataset(split, img_size=img_size)
+        self.resize = transforms.Resize((img_size, img_size))
+        self.to_tensor = transforms.PILToTensor()
+        self.classes = self.folder.classes
+        self.samples = self.folder.samples
+        self.targets = self.folder.targets
+    
+    def __len__(self):
+        return len(self.folder)
+    
+    def __getitem__(self, index):
+        image, label = self.folder[index]
+        return self.to_tensor(self.resize(image)), label
+
+
+def dataset_snapshot(dataset):
+    """
+    Record which files an ImageFolder dataset contains
+    
+    Stored in checkpoints so later runs can tell which images were added
+    after the model was trained.
+    
+    Args:
+        dataset: PyTorch ImageFolder dataset or ZipImageDataset
+    
+    Returns:
+        Sorted list of file paths relative to the dataset root (POSIX style)
+    """
+    return sorted(relative_sample_paths(dataset))
+
+
+def relative_sample_paths(dataset):
+    """
+    Path of every sample relative to the split root (POSIX style)
+    
+    Paths are the same whether the split is read from the extracted
+    directory or from the archive.
+    
+    Args:
+        dataset: PyTorch ImageFolder dataset or ZipImageDataset
+    
+    Returns:
+        List of relative paths in sample order
+    """
+    if isinstance(dataset, ZipImageDataset):
+        root = PurePosixPath(dataset.root)
+        return [PurePosixPath(name).relative_to(root).as_posix() for name, _ in dataset.samples]
+    root = Path(dataset.root)
+    return [Path(path).relative_to(root).as_posix() for path, _ in dataset.samples]
+
+
+# Split name to split directory name, shared by the archive and the extracted tree
+ARCHIVE_SPLITS = {
+    'train': config.TRAIN_DIR.name,
+    'val': config.VAL_DIR.name,
+    'test': config.TEST_DIR.name,
+}
+
+
+def build_archive_index(archive_path, split_dirs, cache_path=config.ARCHIVE_INDEX_CACHE):
+    """
+    Index the images of a dataset zip archive by split and class
+    
+    Only the central directory is read. Image members are matched by a path
+    component equal to one of the split directory names, followed by the
+    class directory. The result is cached per archive and reused while the
+    archive's size and modification time are unchanged.
+    
+    Args:
+        archive_path: Path to the zip archive
+        split_dirs: Dictionary of split name to split directory name,
+            e.g. {'train': 'train_balanced', 'val': 'split_val', 'test': 'test'};
+            the class list of the first split is used for all of them
+        cache_path: JSON file holding cached indices (None disables caching)
+    
+    Returns:
+        Dictionary of split name to {'root', 'classes', 'members', 'names',
+        'targets'}, where members are positions in ZipFile.infolist()
+    
+    Raises:
+        ValueError: If a split is empty or its class folders differ from
+            those of the first split
+    """
+    archive_path = Path(archive_path).resolve()
+    stat = archive_path.stat()
+    # 'v2': indices cached before classes were shared across splits are ignored
+    key = f"v2|{archive_path}|{stat.st_size}|{stat.st_mtime_ns}|{sorted(split_dirs.items())}"
+    
+    cache = {}
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path, encoding='utf-8') as f:
+            cache = json.load(f)
+    if key in cache:
+        return cache[key]
+    
+    dir_to_split = {name: split for split, name in split_dirs.items()}
+    found = {split: [] for split in split_dirs}
+    roots = {}
+    with zipfile.ZipFile(archive_path) as zf:
+        for position, info in enumerate(zf.infolist()):
+            if info.is_dir() or not info.filename.lower().endswith(IMG_EXTENSIONS):
+                continue
+            parts = PurePosixPath(info.filename).parts
+            for depth, part in enumerate(parts[:-2]):
+                if part in dir_to_split:
+                    split = dir_to_split[part]
+                    roots.setdefault(split, '/'.join(parts[:depth + 1]))
+                    found[split].append((parts[depth + 1], info.filename, position))
+                    break
+    
+    for split, entries in found.items():
+        if not entries:
+            raise ValueError(f"No images of the {split} split found in {archive_path}")
+    
+    # One class list for every split (that of the first split, normally
+    # train), in ImageFolder order; a split with other classes would
+    # otherwise get shifted class indices
+    split_classes = {split: sorted({c for c, _, _ in entries}) for split, entries in found.items()}
+    reference = next(iter(split_classes))
+    classes = split_classes[reference]
+    class_to_idx = {name: i for i, name in enumerate(classes)}
+    for split, names in split_classes.items():
+        if names != classes:
+            missing = sorted(set(classes) - set(names))
+            unknown = sorted(set(names) - set(classes))
+            raise ValueError(
+                f"Class folders of the {split} split in {archive_path} do not match the "
+                f"{reference} split (missing: {missing}, unknown: {unknown})"
+            )
+    
+    index = {}
+    for split, entries in found.items():
+        # Same sample order as ImageFolder
+        entries.sort(key=lambda entry: (class_to_idx[entry[0]], entry[1]))
+        index[split] = {
+            'root': roots.get(split, split_dirs[split]),
+            'classes': classes,
+            'members': [position for _, _, position in entries],
+            'names': [name for _, name, _ in entries],
+            'targets': [class_to_idx[class_name] for class_name, _, _ in entries],
+        }
+    
+    if cache_path is not None:
+        cache[key] = index
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+    
+    return index
+
+
+class ZipImageDataset(Dataset):
+    """
+    ImageFolder-like dataset that reads images straight from a zip archive
+    
+    Members are addressed by their position in the archive's central
+    directory. Every process (the main process or a DataLoader worker) opens
+    the archive once, on first access, and reads all its members from that
+    handle; the handle itself is never pickled to workers.
+    """
+    
+    def __init__(self, archive_path, split_index, transform=None, img_size=config.IMG_SIZE):
+        """
+        Args:
+            archive_path: Path to the zip archive
+            split_index: One split of build_archive_index()
+            transform: Transform applied to the decoded PIL image
+            img_size: Size the image is resized to by the transforms
+        """
+        self.archive_path = str(archive_path)
+        self.root = split_index['root']
+        self.classes = split_index['classes']
+        self.class_to_idx = {name: i for i, name in enumerate(self.classes)}
+        self.members = split_index['members']
+        self.targets = split_index['targets']
+        self.samples = list(zip(split_index['names'], self.targets))
+        self.transform = transform
+        self.target_size = (img_size, img_size) if config.FAST_JPEG_DECODE else None
+        self._zip = None
+        self._infos = None
+        self._pid = None
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_zip'] = None
+        state['_infos'] = None
+        state['_pid'] = None
+        return state
+    
+    def _archive(self):
+        # Reopen after a fork so processes never share a file position
+        if self._zip is None or self._pid != os.getpid():
+            self._zip = zipfile.ZipFile(self.archive_path)
+            self._infos = self._zip.infolist()
+            self._pid = os.getpid()
+        return self._zip
+    
+    def __len__(self):
+        return len(self.members)
+    
+    def modification_times(self):
+        """
+        Modification time of every sample from the archive directory
+        
+        Zip entries store local time at two-second resolution.
+        
+        Returns:
+            List of timestamps (seconds since the epoch) in sample order
+        """
+        self._archive()
+        return [time.mktime(self._infos[member].date_time + (0, 0, -1)) for member in self.members]
+    
+    def read_bytes(self, index):
+        """Raw encoded bytes of a sample"""
+        archive = self._archive()
+        return archive.read(self._infos[self.members[index]])
+    
+    def __getitem__(self, index):
+        image = open_image(io.BytesIO(self.read_bytes(index)), self.target_size)
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, self.targets[index]
+
+
+def get_archive_datasets(archive_path, img_size=config.IMG_SIZE):
+    """
+    Train, validation and test datasets from one dataset archive
+    
+    Split directory names are taken from TRAIN_DIR, VAL_DIR and TEST_DIR.
+    
+    Args:
+        archive_path: Path to the zip archive
+        img_size: Target image size
+    
+    Returns:
+        train_dataset, val_dataset, test_dataset
+    """
+    index = build_archive_index(archive_path, ARCHIVE_SPLITS)
+    train_dataset = ZipImageDataset(archive_path, index['train'], get_train_transforms(img_size), img_size)
+    val_dataset = ZipImageDataset(archive_path, index['val'], get_val_transforms(img_size), img_size)
+    test_dataset = ZipImageDataset(archive_path, index['test'], get_val_transforms(img_size), img_size)
+    return train_dataset, val_dataset, test_dataset
+
+
+def get_split_dataset(split, transform=None, img_size=config.IMG_SIZE, archive=config.DATA_ARCHIVE):
+    """
+    Dataset of one split, from the archive if one is configured
+    
+    Args:
+        split: 'train', 'val' or 'test'
+        transform: Transform applied to the decoded PIL image
+        img_size: Size the image is resized to by the transforms
+        archive: Dataset zip archive (default: config.DATA_ARCHIVE); the
+            extracted directories are used if None
+    
+    Returns:
+        ImageFolder or ZipImageDataset with 'classes', 'samples', 'targets'
+        and 'root'
+    """
+    if split not in ARCHIVE_SPLITS:
+        raise ValueError(f"Split {split} not supported. Choose from {list(ARCHIVE_SPLITS.keys())}")
+    if archive is not None:
+        index = build_archive_index(archive, ARCHIVE_SPLITS)
+        return ZipImageDataset(archive, index[split], transform, img_size)
+    
+    root = {'train': config.TRAIN_DIR, 'val': config.VAL_DIR, 'test': config.TEST_DIR}[split]
+    return ImageFolder(root=str(root), transform=transform, loader=ImageLoader(img_size))
@@ -0,0 +1,159 @@
+"""
+Staged backbone freezing and gradual unfreezing
+
+The first blocks of model.features can be frozen: they run under no-grad
+in eval mode, keep requires_grad=False, and never receive gradients, so
+AdamW allocates no state for them. Blocks are unfrozen from the top down on
+an epoch schedule, and every block gets its own learning rate that decays
+with depth (discriminative learning rates).
+"""
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+import config
+
+
+class PartiallyFrozenSequential(nn.Sequential):
+    """
+    nn.Sequential whose first num_frozen modules run without autograd
+    
+    Subclassing nn.Sequential keeps state dict keys unchanged, so checkpoints
+    remain loadable into the plain model.
+    """
+    
+    def __init__(self, *modules, num_frozen=0):
+        super().__init__(*modules)
+        self.num_frozen = 0
+        self.set_num_frozen(num_frozen)
+    
+    def set_num_frozen(self, num_frozen):
+        """
+        Freeze the first num_frozen modules and unfreeze the rest
+        
+        Args:
+            num_frozen: Number of leading modules to freeze
+        """
+        self.num_frozen = max(0, min(num_frozen, len(self)))
+        for i, module in enumerate(self):
+            frozen = i < self.num_frozen
+            for param in module.parameters():
+                param.requires_grad = not frozen
+                if frozen:
+                    param.grad = None
+        self.train(self.training)
+    
+    def train(self, mode=True):
+        super().train(mode)
+        # Frozen blocks keep their BatchNorm statistics fixed
+        for module in list(self)[:self.num_frozen]:
+            module.eval()
+        return self
+    
+    def forward(self, x):
+        modules = list(self)
+        if self.num_frozen:
+            with torch.no_grad():
+                for module in modules[:self.num_frozen]:
+                    x = module(x)
+        for module in modules[self.num_frozen:]:
+            x = module(x)
+        return x
+
+
+def parse_unfreeze_schedule(spec):
+    """
+    Parse an unfreeze schedule string
+    
+    Args:
+        spec: Comma separated 'epoch:first_trainable_block' pairs, e.g.
+            '1:6,4:4,7:2,10:0' trains features[6:] from epoch 1 and
+            features[4:] from epoch 4, and so on
+    
+    Returns:
+        Dictionary of epoch to index of the first trainable features block
+    """
+    schedule = {}
+    for item in spec.split(','):
+        epoch, block = item.split(':')
+        schedule[int(epoch)] = int(block)
+    return schedule
+
+
+def enable_staged_freezing(model, schedule):
+    """
+    Wrap model.features so its leading blocks can be frozen
+    
+    Args:
+        model: EfficientNet model
+        schedule: Dictionary of epoch to first trainable features block
+    
+    Returns:
+        The model (modified in place), frozen according to the first epoch
+    """
+    first_epoch = min(schedule)
+    model.features = PartiallyFrozenSequential(
+        *model.features, num_frozen=schedule[first_epoch]
+    )
+    return model
+
+
+def update_frozen_blocks(model, schedule, epoch):
+    """
+    Apply the schedule entry for an epoch, if there is one
+    
+    Args:
+        model: Model prepared with enable_staged_freezing
+        schedule: Dictionary of epoch to first trainable features block
+        epoch: Current epoch (1-based)
+    
+    Returns:
+        True if the frozen blocks changed
+    """
+    if epoch not in schedule or schedule[epoch] == model.features.num_frozen:
+        return False
+    model.features.set_num_frozen(schedule[epoch])
+    return True
+
+
+def build_discriminative_optimizer(model, lr, weight_decay=0.0001, decay=config.LAYER_LR_DECAY):
+    """
+    AdamW with one parameter group per features block and one for the classifier
+    
+    The classifier uses lr; features[i] uses lr * decay ** (depth from the
+    top), so earlier blocks are fine-tuned more gently once unfrozen. Frozen
+    parameters are included but never get gradients, so no optimizer state
+    is allocated for them.
+    
+    Args:
+        model: EfficientNet model
+        lr: Learning rate of the classifier
+        weight_decay: AdamW weight decay
+        decay: Per-block learning rate decay
+    
+    Returns:
+        AdamW optimizer
+    """
+    num_blocks = len(model.features)
+    groups = [{'params': list(model.classifier.parameters()), 'lr': lr}]
+    for i, block in enumerate(model.features):
+        groups.append({
+            'params': list(block.parameters()),
+            'lr': lr * decay ** (num_blocks - i),
+        })
+    return optim.AdamW(groups, lr=lr, weight_decay=weight_decay)
+
+
+def trainable_parameter_count(model):
+    """Number of parameters that currently require gradients"""
+    return sum(p.numel() for p in model.parameters() if p.requires_grad)
+
+
+def optimizer_state_bytes(optimizer):
+    """Memory held by optimizer state tensors in bytes"""
+    total = 0
+    for state in optimizer.state.values():
+        for value in state.values():
+            if torch.is_tensor(value):
+                total += value.numel() * value.element_size()
+    return total
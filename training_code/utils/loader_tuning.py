@@ -0,0 +1,214 @@
+"""
+DataLoader auto-tuning
+
+Probes the host with short timed runs over worker counts, prefetch factors,
+persistent workers, memory pinning, torch intra-op thread counts and
+(optionally) batch sizes, and caches the fastest combination per host.
+
+The search is coordinate descent: one setting is varied at a time while the
+others stay at their best value so far, which needs a few dozen probes
+instead of the full grid.
+"""
+import copy
+import json
+import os
+import platform
+import random
+import time
+
+import torch
+from torch.utils.data import DataLoader, Subset
+
+import config
+from utils.dataset import get_loader_kwargs, get_split_dataset
+from utils.transforms import get_train_transforms
+
+
+def host_signature(dataset_root, img_size, batch_sizes=None):
+    """
+    Identify the host and data the tuned settings are valid for
+    
+    Args:
+        dataset_root: Root of the probed dataset
+        img_size: Target image size
+        batch_sizes: Batch size candidates of the search
+    
+    Returns:
+        Signature string
+    """
+    gpu = torch.cuda.get_device_name(0) if torch.cuda.is_available() else 'cpu'
+    batch_sizes = list(batch_sizes or [config.BATCH_SIZE])
+    return f"{platform.node()}|{os.cpu_count()}|{gpu}|{dataset_root}|{img_size}|{batch_sizes}"
+
+
+def default_grid(batch_sizes=None):
+    """
+    Candidate values for every tuned setting
+    
+    Args:
+        batch_sizes: Batch sizes to try (default: only config.BATCH_SIZE)
+    
+    Returns:
+        Dictionary of setting name to candidate values
+    """
+    cpus = os.cpu_count() or 1
+    workers = sorted({0, 2, 4, 8, 12, 16} & set(range(cpus + 1)) | {min(cpus, config.NUM_WORKERS)})
+    threads = sorted({1, max(1, cpus // 2), cpus})
+    return {
+        'batch_size': list(batch_sizes or [config.BATCH_SIZE]),
+        'num_workers': workers,
+        'prefetch_factor': [2, 4, 8],
+        'persistent_workers': [False, True],
+        'pin_memory': [False, True] if torch.cuda.is_available() else [False],
+        'num_threads': threads,
+    }
+
+
+def _probe(dataset, settings, num_batches, epochs, model, device):
+    """
+    Images per second for one combination of settings
+    
+    Each probe runs several short epochs so that worker start-up (and the
+    benefit of persistent workers) is part of the measurement. If a model is
+    given, every batch also runs a forward and backward pass so thread count
+    and pinning are measured against real compute.
+    """
+    torch.set_num_threads(settings['num_threads'])
+    
+    batch_size = settings['batch_size']
+    # Random sample across all classes; ImageFolder order is sorted by class
+    num_images = min(len(dataset), batch_size * num_batches)
+    subset = Subset(dataset, random.Random(config.SEED).sample(range(len(dataset)), num_images))
+    loader = DataLoader(
+        subset,
+        batch_size=batch_size,
+        shuffle=True,
+        **get_loader_kwargs(
+            num_workers=settings['num_workers'],
+            pin_memory=settings['pin_memory'],
+            persistent_workers=settings['persistent_workers'],
+            prefetch_factor=settings['prefetch_factor']
+        )
+    )
+    
+    images_seen = 0
+    start = time.perf_counter()
+    for _ in range(epochs):
+        for images, labels in loader:
+            images = images.to(device, non_blocking=settings['pin_memory'])
+            if model is not None:
+                model.zero_grad(set_to_none=True)
+                model(images).sum().backward()
+            images_seen += len(images)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    elapsed = time.perf_counter() - start
+    
+    del loader
+    return images_seen / elapsed
+
+
+def autotune(dataset, img_size=config.IMG_SIZE, model=None, device='cpu', batch_sizes=None,
+             grid=None, num_batches=20, epochs=2, cache_path=config.LOADER_TUNING_CACHE,
+             force=False, logger=None):
+    """
+    Find the fastest DataLoader settings for this host, using the cache if possible
+    
+    Args:
+        dataset: Dataset to probe (typically the training dataset)
+        img_size: Target image size of the dataset
+        model: Optional model to include a forward/backward pass in each probe
+        device: Device batches are moved to
+        batch_sizes: Batch sizes to try (default: only config.BATCH_SIZE)
+        grid: Candidate values overriding default_grid()
+        num_batches: Batches per probe epoch
+        epochs: Probe epochs per combination
+        cache_path: JSON file holding tuned settings per host
+        force: Re-tune even if cached settings exist
+        logger: Logger for progress messages (prints if None)
+    
+    Returns:
+        Dictionary with 'batch_size', 'num_workers', 'prefetch_factor',
+        'persistent_workers', 'pin_memory', 'num_threads' and 'images_per_sec'
+    """
+    log = logger.info if logger is not None else print
+    device = torch.device(device)
+    signature = host_signature(getattr(dataset, 'root', ''), img_size, batch_sizes)
+    
+    cache = {}
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+    if not force and signature in cache:
+        log(f"Using cached DataLoader settings: {cache[signature]}")
+        return cache[signature]
+    
+    grid = grid or default_grid(batch_sizes)
+    probe_model = copy.deepcopy(model).to(device).train() if model is not None else None
+    original_threads = torch.get_num_threads()
+    
+    # Start from the first candidate of each setting and the current thread count
+    best = {name: values[0] for name, values in grid.items()}
+    best['num_threads'] = original_threads
+    best_rate = 0.0
+    measured = {}
+    
+    try:
+        for name, values in grid.items():
+            for value in values:
+                settings = dict(best, **{name: value})
+                key = json.dumps(settings, sort_keys=True)
+                if key not in measured:
+                    try:
+                        measured[key] = _probe(dataset, settings, num_batches, epochs, probe_model, device)
+                    except RuntimeError as e:
+                        # e.g. CUDA out of memory for a large batch size
+                        log(f"Probe failed for {settings}: {e}")
+                        measured[key] = 0.0
+                        if device.type == 'cuda':
+                            torch.cuda.empty_cache()
+                    log(f"  {settings} -> {measured[key]:.1f} images/sec")
+                
+                if measured[key] > best_rate:
+                    best_rate = measured[key]
+                    best = settings
+    finally:
+        torch.set_num_threads(original_threads)
+    
+    best = dict(best, images_per_sec=best_rate)
+    log(f"Best DataLoader settings: {best}")
+    
+    if cache_path is not None:
+        cache[signature] = best
+        with open(cache_path, 'w') as f:
+            json.dump(cache, f, indent=2)
+    
+    return best
+
+
+def autotune_for_training(model=None, device='cpu', img_size=config.IMG_SIZE,
+                          batch_sizes=None, force=False, logger=None):
+    """
+    Auto-tune DataLoader settings on the training split
+    
+    Args:
+        model: Optional model to include a forward/backward pass in each probe
+        device: Device batches are moved to
+        img_size: Target image size
+        batch_sizes: Batch sizes to try (default: only config.BATCH_SIZE)
+        force: Re-tune even if cached settings exist
+        logger: Logger for progress messages
+    
+    Returns:
+        Tuned settings (see autotune)
+    """
+    dataset = get_split_dataset('train', get_train_transforms(img_size), img_size)
+    return autotune(
+        dataset,
+        img_size=img_size,
+        model=model,
+        device=device,
+        batch_sizes=batch_sizes,
+        force=force,
+        logger=logger
+    )
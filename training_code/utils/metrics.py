@@ -2,16 +2,20 @@
 Evaluation metrics for model performance
 """
 import torch
+import torch.nn.functional as F
 import numpy as np
 from sklearn.metrics import (
     accuracy_score,
     f1_score,
     precision_score,
     recall_score,
+    precision_recall_fscore_support,
     confusion_matrix,
     classification_report
 )
 
+from utils.dataset import relative_sample_paths
+
 
 def calculate_metrics(y_true, y_pred, average='macro'):
     """
@@ -52,6 +56,24 @@ def get_confusion_matrix(y_true, y_pred):
     return confusion_matrix(y_true, y_pred)
 
 
+def get_per_class_metrics(y_true, y_pred, num_classes):
+    """
+    Calculate precision, recall and F1 of every class
+    
+    Args:
+        y_true: Ground truth labels
+        y_pred: Predicted labels
+        num_classes: Number of classes
+    
+    Returns:
+        Dictionary with 'precision', 'recall' and 'f1' lists indexed by class
+    """
+    precision, recall, f1, _ = precision_recall_fscore_support(
+        y_true, y_pred, labels=list(range(num_classes)), zero_division=0
+    )
+    return {'precision': precision.tolist(), 'recall': recall.tolist(), 'f1': f1.tolist()}
+
+
 def get_classification_report(y_true, y_pred, class_names):
     """
     Generate classification report
@@ -72,15 +94,19 @@ def get_classification_report(y_true, y_pred, class_names):
     )
 
 
-def evaluate_model(model, dataloader, device, class_names):
+def evaluate_model(model, dataloader, device, class_names, store=None,
+                   run_id=None, checkpoint_id=None):
     """
     Evaluate model on a dataset
     
     Args:
         model: PyTorch model
-        dataloader: DataLoader for evaluation
+        dataloader: DataLoader for evaluation (must not shuffle)
         device: Device to run evaluation on
         class_names: List of class names
+        store: PredictionStore to persist per-sample records (optional)
+        run_id: Run identifier used as the store key
+        checkpoint_id: Checkpoint identifier used as the store key
     
     Returns:
         Dictionary with metrics, predictions, and ground truth
@@ -89,6 +115,7 @@ def evaluate_model(model, dataloader, device, class_names):
     all_preds = []
     all_labels = []
     all_probs = []
+    all_losses = []
     
     with torch.no_grad():
         for images, labels in dataloader:
@@ -98,21 +125,52 @@ def evaluate_model(model, dataloader, device, class_names):
             outputs = model(images)
             probs = torch.softmax(outputs, dim=1)
             _, preds = torch.max(probs, 1)
+            losses = F.cross_entropy(outputs, labels, reduction='none')
             
-            all_preds.extend(preds.cpu().numpy())
-            all_labels.extend(labels.cpu().numpy())
-            all_probs.extend(probs.cpu().numpy())
+            all_preds.append(preds.cpu().numpy())
+            all_labels.append(labels.cpu().numpy())
+            all_probs.append(probs.cpu().numpy())
+            all_losses.append(losses.cpu().numpy())
+    
+    all_preds = np.concatenate(all_preds)
+    all_labels = np.concatenate(all_labels)
+    all_probs = np.concatenate(all_probs)
+    all_losses = np.concatenate(all_losses)
     
     # Calculate metrics
     metrics = calculate_metrics(all_labels, all_preds)
     cm = get_confusion_matrix(all_labels, all_preds)
+    per_class = get_per_class_metrics(all_labels, all_preds, len(class_names))
     report = get_classification_report(all_labels, all_preds, class_names)
     
+    # Persist per-sample records, keyed by path relative to the split root so
+    # records stay comparable after images are added to the split
+    if store is not None:
+        dataset = dataloader.dataset
+        sample_ids = np.arange(len(all_labels))
+        if hasattr(dataset, 'samples'):
+            paths = relative_sample_paths(dataset)
+        else:
+            paths = [str(i) for i in sample_ids]
+        
+        store.write(
+            run_id=run_id,
+            checkpoint_id=checkpoint_id,
+            sample_ids=sample_ids,
+            paths=paths,
+            labels=all_labels,
+            probabilities=all_probs,
+            losses=all_losses,
+            class_names=class_names
+        )
+    
     return {
         'metrics': metrics,
         'confusion_matrix': cm,
+        'per_class': per_class,
         'classification_report': report,
-        'predictions': np.array(all_preds),
-        'labels': np.array(all_labels),
-        'probabilities': np.array(all_probs)
+        'predictions': all_preds,
+        'labels': all_labels,
+        'probabilities': all_probs,
+        'losses': all_losses
     }
@@ -0,0 +1,383 @@
+"""
+Content-addressed prediction cache
+
+Predictions are keyed by a hash of the raw image bytes plus the identity of
+the checkpoint that produced them. A bounded in-memory LRU tier sits in
+front of a persistent on-disk tier with size-based eviction. When the
+checkpoint file changes, its identity changes and stale entries are dropped.
+"""
+import hashlib
+import io
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import torch
+
+import config
+from utils.checkpoint import get_checkpoint_path, load_model
+from utils.dataset import open_image
+from utils.transforms import get_val_transforms
+
+
+def _hash_file(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    Two-tier cache of prediction vectors keyed by image content and checkpoint
+    """
+    
+    def __init__(self, checkpoint_path, cache_dir=config.PREDICTION_CACHE_DIR,
+                 memory_items=config.CACHE_MEMORY_ITEMS, disk_bytes=config.CACHE_DISK_BYTES,
+                 variant=''):
+        """
+        Args:
+            checkpoint_path: Checkpoint whose predictions are cached
+            cache_dir: Root directory of the disk tier
+            memory_items: Maximum number of entries in the memory tier
+            disk_bytes: Maximum total size of the disk tier in bytes
+            variant: Extra key material, e.g. the preprocessing configuration
+        """
+        self.checkpoint_path = Path(checkpoint_path)
+        self.cache_dir = Path(cache_dir)
+        self.memory_items = memory_items
+        self.disk_bytes = disk_bytes
+        self.variant = variant
+        
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._disk_index = OrderedDict()
+        self._disk_total = 0
+        self._signature = None
+        self.identity = None
+        self._refresh_identity()
+    
+    def _stat_signature(self):
+        stat = os.stat(self.checkpoint_path)
+        return (stat.st_size, stat.st_mtime_ns)
+    
+    def refresh(self):
+        """
+        Pick up changes to the checkpoint file
+        
+        Returns:
+            Current checkpoint identity
+        """
+        with self._lock:
+            self._refresh_identity()
+            return self.identity
+    
+    def _refresh_identity(self):
+        """Recompute the checkpoint identity if the file changed"""
+        signature = self._stat_signature()
+        if signature == self._signature:
+            return
+        
+        self._signature = signature
+        identity = hashlib.sha256(
+            (_hash_file(self.checkpoint_path) + self.variant).encode()
+        ).hexdigest()[:16]
+        if identity == self.identity:
+            return
+        
+        self.identity = identity
+        self._memory.clear()
+        
+        # Entries of previous versions of this checkpoint can never be hit again
+        source = f'{self.checkpoint_path.resolve()}|{self.variant}'
+        if self.cache_dir.exists():
+            for entry in self.cache_dir.iterdir():
+                marker = entry / 'source.txt'
+                if entry.name != identity and marker.exists() and marker.read_text(encoding='utf-8') == source:
+                    shutil.rmtree(entry, ignore_errors=True)
+        
+        self._disk_dir.mkdir(parents=True, exist_ok=True)
+        (self._disk_dir / 'source.txt').write_text(source, encoding='utf-8')
+        self._load_disk_index()
+    
+    @property
+    def _disk_dir(self):
+        return self.cache_dir / self.identity
+    
+    def _disk_path(self, key):
+        return self._disk_dir / key[:2] / f'{key}.npy'
+    
+    def _load_disk_index(self):
+        """Index existing disk entries, least recently used first"""
+        entries = []
+        if self._disk_dir.exists():
+            for path in self._disk_dir.glob('*/*.npy'):
+                stat = path.stat()
+                entries.append((stat.st_mtime_ns, path.stem, stat.st_size))
+        entries.sort()
+        
+        self._disk_index = OrderedDict((key, size) for _, key, size in entries)
+        self._disk_total = sum(self._disk_index.values())
+        self._evict_disk()
+    
+    def _evict_disk(self):
+        while self._disk_total > self.disk_bytes and self._disk_index:
+            key, size = self._disk_index.popitem(last=False)
+            self._disk_total -= size
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+    
+    def key(self, image_bytes):
+        """
+        Cache key of an image
+        
+        Args:
+            image_bytes: Raw encoded image bytes
+        
+        Returns:
+            Hex digest identifying the image content
+        """
+        return hashlib.sha256(image_bytes).hexdigest()
+    
+    def get(self, key):
+        """
+        Look up a prediction
+        
+        Args:
+            key: Cache key from key()
+        
+        Returns:
+            Prediction array, or None on a miss
+        """
+        with self._lock:
+            self._refresh_identity()
+            
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return value
+            
+            if key in self._disk_index:
+                path = self._disk_path(key)
+                try:
+                    value = np.load(path)
+                except (FileNotFoundError, ValueError):
+                    self._disk_total -= self._disk_index.pop(key)
+                else:
+                    os.utime(path)
+                    self._disk_index.move_to_end(key)
+                    self._put_memory(key, value)
+                    self.hits_disk += 1
+                    return value
+            
+            self.misses += 1
+            return None
+    
+    def _put_memory(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+    
+    def put(self, key, value, identity=None):
+        """
+        Store a prediction in both tiers
+        
+        Args:
+            key: Cache key from key()
+            value: Prediction array
+            identity: Checkpoint identity the prediction was computed with;
+                if given and the checkpoint has changed since, nothing is stored
+        """
+        value = np.asarray(value, dtype=np.float32)
+        with self._lock:
+            self._refresh_identity()
+            if identity is not None and identity != self.identity:
+                return
+            self._put_memory(key, value)
+            
+            path = self._disk_path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                np.save(f, value)
+            os.replace(tmp_path, path)
+            
+            if key in self._disk_index:
+                self._disk_total -= self._disk_index.pop(key)
+            size = path.stat().st_size
+            self._disk_index[key] = size
+            self._disk_total += size
+            self._evict_disk()
+    
+    def clear(self):
+        """Remove every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            for key in self._disk_index:
+                try:
+                    os.remove(self._disk_path(key))
+                except FileNotFoundError:
+                    pass
+            self._disk_index.clear()
+            self._disk_total = 0
+    
+    def stats(self):
+        """
+        Hit-rate statistics
+        
+        Returns:
+            Dictionary with hit counts, hit rate and tier sizes
+        """
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            'hits_memory': self.hits_memory,
+            'hits_disk': self.hits_disk,
+            'misses': self.misses,
+            'hit_rate': (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+            'memory_items': len(self._memory),
+            'disk_items': len(self._disk_index),
+            'disk_bytes': self._disk_total,
+        }
+
+
+class CachedPredictor:
+    """
+    Predicts class probabilities for encoded images, skipping cached ones
+    
+    Only cache misses are decoded, transformed and batched through the model.
+    If the checkpoint file changes, the model is reloaded before any miss is
+    computed, so predictions are always stored under the identity of the
+    weights that produced them.
+    """
+    
+    def __init__(self, model, cache, transform=None, device='cpu', batch_size=32,
+                 img_size=config.IMG_SIZE, model_name=None):
+        """
+        Args:
+            model: Model in eval mode, loaded from the cache's checkpoint
+            cache: PredictionCache for the model's checkpoint
+            transform: Preprocessing transform (default: get_val_transforms())
+            device: Device the model lives on
+            batch_size: Batch size for cache misses
+            img_size: Size the transform resizes to, used for JPEG draft decoding
+            model_name: Model architecture name, needed to reload the model
+                when the checkpoint changes
+        """
+        self.model = model
+        self.cache = cache
+        self.model_name = model_name
+        self.model_identity = cache.refresh()
+        self.transform = transform or get_val_transforms(img_size)
+        self.device = torch.device(device)
+        self.batch_size = batch_size
+        self.decode_size = (img_size, img_size) if config.FAST_JPEG_DECODE else None
+    
+    @classmethod
+    def from_checkpoint(cls, model_name, checkpoint_path=None, device='cpu', **cache_kwargs):
+        """
+        Build a cached predictor from a trained checkpoint
+        
+        Args:
+            model_name: Model architecture name
+            checkpoint_path: Path to the checkpoint (default: best_model.pth)
+            device: Device to run on
+            **cache_kwargs: Extra PredictionCache arguments
+        
+        Returns:
+            CachedPredictor
+        """
+        if checkpoint_path is None:
+            checkpoint_path = get_checkpoint_path(model_name)
+        img_size = config.MODEL_IMG_SIZES.get(model_name, config.IMG_SIZE)
+        
+        decode = 'draft' if config.FAST_JPEG_DECODE else 'full'
+        cache = PredictionCache(checkpoint_path, variant=f'{model_name}:{img_size}:{decode}', **cache_kwargs)
+        model = load_model(model_name, checkpoint_path, device=device)
+        return cls(model, cache, transform=get_val_transforms(img_size), device=device,
+                   img_size=img_size, model_name=model_name)
+    
+    def _sync_model(self):
+        """
+        Reload the model if the checkpoint changed since it was loaded
+        
+        Returns:
+            Identity of the loaded weights
+        """
+        identity = self.cache.refresh()
+        while identity != self.model_identity:
+            if self.model_name is None:
+                raise RuntimeError(
+                    f"Checkpoint {self.cache.checkpoint_path} changed; pass model_name to reload it"
+                )
+            self.model = load_model(self.model_name, self.cache.checkpoint_path, device=self.device)
+            self.model_identity = identity
+            # The file may have changed again while it was being loaded
+            identity = self.cache.refresh()
+        return identity
+    
+    def predict_bytes(self, images):
+        """
+        Predict a list of encoded images
+        
+        Args:
+            images: List of raw image bytes
+        
+        Returns:
+            Probabilities [N, num_classes]
+        """
+        keys = [self.cache.key(data) for data in images]
+        results = [self.cache.get(key) for key in keys]
+        
+        # Deduplicate misses so repeated uploads in one call run once
+        pending = OrderedDict()
+        for i, (key, result) in enumerate(zip(keys, results)):
+            if result is None:
+                pending.setdefault(key, []).append(i)
+        
+        pending_keys = list(pending.keys())
+        identity = self._sync_model() if pending_keys else None
+        for start in range(0, len(pending_keys), self.batch_size):
+            batch_keys = pending_keys[start:start + self.batch_size]
+            batch = torch.stack([
+                self.transform(open_image(io.BytesIO(images[pending[key][0]]), self.decode_size))
+                for key in batch_keys
+            ]).to(self.device)
+            
+            with torch.no_grad():
+                probs = torch.softmax(self.model(batch), dim=1).cpu().numpy()
+            
+            for key, p in zip(batch_keys, probs):
+                self.cache.put(key, p, identity=identity)
+                for i in pending[key]:
+                    results[i] = p
+        
+        return np.stack(results)
+    
+    def predict_paths(self, paths):
+        """
+        Predict a list of image files
+        
+        Args:
+            paths: List of image paths
+        
+        Returns:
+            Probabilities [N, num_classes]
+        """
+        images = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                images.append(f.read())
+        return self.predict_bytes(images)
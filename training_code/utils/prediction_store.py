@@ -0,0 +1,280 @@
+"""
+Columnar on-disk store for per-sample evaluation records
+
+Each (run, checkpoint) pair is saved as a directory of .npy columns that are
+memory-mapped on read, plus a JSON path index:
+    
+    <root>/<run_id>/<checkpoint_id>/
+        sample_id.npy       int64   [N]
+        label.npy           int16   [N]
+        prob.npy            float32 [N, num_classes]
+        loss.npy            float32 [N]
+        paths.json          list of N image paths relative to the split root
+        meta.json           class names, creation time, sample count
+
+Queries only touch the columns they need and never load a model.
+"""
+import json
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+
+import config
+
+
+COLUMNS = {
+    'sample_id': np.int64,
+    'label': np.int16,
+    'prob': np.float32,
+    'loss': np.float32,
+}
+
+
+class PredictionStore:
+    """
+    Persist and query per-sample predictions keyed by run and checkpoint
+    """
+    
+    def __init__(self, root=config.PREDICTION_STORE_DIR):
+        """
+        Args:
+            root: Root directory of the store
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+    
+    def _record_dir(self, run_id, checkpoint_id):
+        return self.root / str(run_id) / str(checkpoint_id)
+    
+    def write(self, run_id, checkpoint_id, sample_ids, paths, labels,
+              probabilities, losses, class_names=config.CLASS_NAMES):
+        """
+        Write one evaluation, replacing any previous record for the same key
+        
+        Args:
+            run_id: Run identifier (e.g. model or experiment name)
+            checkpoint_id: Checkpoint identifier (e.g. 'best_model' or 'epoch_24')
+            sample_ids: Dataset index of every sample at evaluation time
+            paths: Image path of every sample relative to the split root;
+                used to align records across runs
+            labels: Ground truth labels
+            probabilities: Softmax probabilities [N, num_classes]
+            losses: Per-sample loss values
+            class_names: List of class names
+        
+        Returns:
+            Path of the written record
+        """
+        arrays = {
+            'sample_id': np.asarray(sample_ids),
+            'label': np.asarray(labels),
+            'prob': np.asarray(probabilities),
+            'loss': np.asarray(losses),
+        }
+        num_samples = len(arrays['sample_id'])
+        for name, array in arrays.items():
+            if len(array) != num_samples:
+                raise ValueError(f"Column {name} has {len(array)} rows, expected {num_samples}")
+        if len(paths) != num_samples:
+            raise ValueError(f"Got {len(paths)} paths, expected {num_samples}")
+        
+        record_dir = self._record_dir(run_id, checkpoint_id)
+        tmp_dir = record_dir.with_name(record_dir.name + '.tmp')
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir(parents=True)
+        
+        for name, dtype in COLUMNS.items():
+            np.save(tmp_dir / f'{name}.npy', arrays[name].astype(dtype, copy=False))
+        
+        with open(tmp_dir / 'paths.json', 'w', encoding='utf-8') as f:
+            json.dump([str(p) for p in paths], f)
+        
+        with open(tmp_dir / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump({
+                'run_id': str(run_id),
+                'checkpoint_id': str(checkpoint_id),
+                'num_samples': num_samples,
+                'class_names': list(class_names),
+                'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            }, f, indent=2)
+        
+        # Swap the finished record in so readers never see a partial write
+        if record_dir.exists():
+            shutil.rmtree(record_dir)
+        tmp_dir.rename(record_dir)
+        
+        return record_dir
+    
+    def list_records(self):
+        """
+        List stored records
+        
+        Returns:
+            List of (run_id, checkpoint_id) tuples
+        """
+        records = []
+        for meta_path in sorted(self.root.glob('*/*/meta.json')):
+            records.append((meta_path.parent.parent.name, meta_path.parent.name))
+        return records
+    
+    def load(self, run_id, checkpoint_id, columns=None):
+        """
+        Memory-map the columns of a record
+        
+        Args:
+            run_id: Run identifier
+            checkpoint_id: Checkpoint identifier
+            columns: Column names to load (default: all)
+        
+        Returns:
+            Dictionary of column name to read-only array
+        """
+        record_dir = self._record_dir(run_id, checkpoint_id)
+        if not (record_dir / 'meta.json').exists():
+            raise FileNotFoundError(f"No predictions stored for run '{run_id}', checkpoint '{checkpoint_id}'")
+        
+        columns = columns or list(COLUMNS.keys())
+        return {
+            name: np.load(record_dir / f'{name}.npy', mmap_mode='r')
+            for name in columns
+        }
+    
+    def load_paths(self, run_id, checkpoint_id):
+        """Load the image path index of a record"""
+        with open(self._record_dir(run_id, checkpoint_id) / 'paths.json', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def load_meta(self, run_id, checkpoint_id):
+        """Load the metadata of a record"""
+        with open(self._record_dir(run_id, checkpoint_id) / 'meta.json', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def predictions(self, run_id, checkpoint_id):
+        """
+        Predicted labels of a record
+        
+        Returns:
+            Array of predicted class indices
+        """
+        prob = self.load(run_id, checkpoint_id, columns=['prob'])['prob']
+        return np.asarray(prob.argmax(axis=1))
+    
+    def confusions(self, run_id, checkpoint_id, min_count=1):
+        """
+        Off-diagonal confusion pairs sorted by frequency
+        
+        Args:
+            run_id: Run identifier
+            checkpoint_id: Checkpoint identifier
+            min_count: Minimum number of samples for a pair to be reported
+        
+        Returns:
+            List of dictionaries with 'true', 'pred' and 'count'
+        """
+        labels = np.asarray(self.load(run_id, checkpoint_id, columns=['label'])['label'])
+        preds = self.predictions(run_id, checkpoint_id)
+        class_names = self.load_meta(run_id, checkpoint_id)['class_names']
+        num_classes = len(class_names)
+        
+        cm = np.bincount(
+            labels.astype(np.int64) * num_classes + preds,
+            minlength=num_classes * num_classes
+        ).reshape(num_classes, num_classes)
+        np.fill_diagonal(cm, 0)
+        
+        true_idx, pred_idx = np.nonzero(cm >= min_count)
+        order = np.argsort(-cm[true_idx, pred_idx], kind='stable')
+        
+        return [
+            {
+                'true': class_names[true_idx[i]],
+                'pred': class_names[pred_idx[i]],
+                'count': int(cm[true_idx[i], pred_idx[i]]),
+            }
+            for i in order
+        ]
+    
+    def top_losses(self, run_id, checkpoint_id, class_idx=None, k=10):
+        """
+        Samples with the highest loss, optionally restricted to one true class
+        
+        Args:
+            run_id: Run identifier
+            checkpoint_id: Checkpoint identifier
+            class_idx: Ground truth class index to restrict to (None for all)
+            k: Number of samples to return
+        
+        Returns:
+            List of dictionaries with 'sample_id', 'path', 'label', 'pred',
+            'confidence' and 'loss'
+        """
+        cols = self.load(run_id, checkpoint_id)
+        loss = np.asarray(cols['loss'])
+        
+        candidates = np.arange(len(loss))
+        if class_idx is not None:
+            candidates = np.nonzero(np.asarray(cols['label']) == class_idx)[0]
+        
+        k = min(k, len(candidates))
+        if k == 0:
+            return []
+        
+        top = candidates[np.argpartition(-loss[candidates], k - 1)[:k]]
+        top = top[np.argsort(-loss[top], kind='stable')]
+        
+        paths = self.load_paths(run_id, checkpoint_id)
+        probs = np.asarray(cols['prob'][top])
+        
+        return [
+            {
+                'sample_id': int(cols['sample_id'][i]),
+                'path': paths[i],
+                'label': int(cols['label'][i]),
+                'pred': int(p.argmax()),
+                'confidence': float(p.max()),
+                'loss': float(loss[i]),
+            }
+            for i, p in zip(top, probs)
+        ]
+    
+    def disagreement(self, run_a, checkpoint_a, run_b, checkpoint_b):
+        """
+        Samples where two records predict different classes
+        
+        Records are aligned by image path, since dataset positions shift when
+        images are added to a split; only samples present in both are
+        compared.
+        
+        Returns:
+            List of dictionaries with 'sample_id' (position in record a),
+            'path', 'label', 'pred_a' and 'pred_b'
+        """
+        ids_a = np.asarray(self.load(run_a, checkpoint_a, columns=['sample_id'])['sample_id'])
+        paths = self.load_paths(run_a, checkpoint_a)
+        _, idx_a, idx_b = np.intersect1d(
+            np.array(paths, dtype=str), np.array(self.load_paths(run_b, checkpoint_b), dtype=str),
+            assume_unique=True, return_indices=True
+        )
+        order = np.argsort(idx_a, kind='stable')
+        idx_a = idx_a[order]
+        idx_b = idx_b[order]
+        
+        preds_a = self.predictions(run_a, checkpoint_a)[idx_a]
+        preds_b = self.predictions(run_b, checkpoint_b)[idx_b]
+        differ = np.nonzero(preds_a != preds_b)[0]
+        
+        labels = self.load(run_a, checkpoint_a, columns=['label'])['label']
+        
+        return [
+            {
+                'sample_id': int(ids_a[idx_a[i]]),
+                'path': paths[idx_a[i]],
+                'label': int(labels[idx_a[i]]),
+                'pred_a': int(preds_a[i]),
+                'pred_b': int(preds_b[i]),
+            }
+            for i in differ
+        ]
@@ -0,0 +1,241 @@
+"""
+Background report and plot generation
+
+Plots and summaries are rendered in a separate process with the Agg backend
+so the training loop never waits on matplotlib. Requests of the same kind
+that queue up while the renderer is busy are coalesced: only the newest
+snapshot is rendered.
+"""
+import json
+import os
+import queue
+import time
+import multiprocessing as mp
+from pathlib import Path
+
+import config
+
+
+# Quality presets trade resolution for render time
+QUALITY_PRESETS = {
+    'draft': {'dpi': 72, 'annotate': False},
+    'standard': {'dpi': 150, 'annotate': True},
+    'publication': {'dpi': 300, 'annotate': True},
+}
+
+
+def _to_builtin(value):
+    """Convert numpy values to JSON serializable Python objects"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if isinstance(value, dict):
+        return {k: _to_builtin(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_builtin(v) for v in value]
+    return value
+
+
+def _atomic_write(path, text):
+    """Write text so readers never see a partially written file"""
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _write_summary(results_dir, state):
+    """Write JSON and HTML summaries of the latest snapshots"""
+    _atomic_write(results_dir / 'summary.json', json.dumps(state, indent=2))
+    
+    rows = []
+    history = state.get('history')
+    if history:
+        rows.append(('Epochs', len(history.get('train_loss', []))))
+        if history.get('val_f1'):
+            rows.append(('Best Val F1 (Macro)', f"{max(history['val_f1']):.4f}"))
+            rows.append(('Last Val Loss', f"{history['val_loss'][-1]:.4f}"))
+    evaluation = state.get('evaluation')
+    if evaluation:
+        for name, value in evaluation.get('metrics', {}).items():
+            rows.append((name, f"{value:.4f}"))
+    
+    table = '\n'.join(f"<tr><td>{k}</td><td>{v}</td></tr>" for k, v in rows)
+    images = '\n'.join(
+        f'<img src="{name}" style="max-width:100%">'
+        for name in state.get('plots', [])
+    )
+    html = (
+        '<html><head><meta charset="utf-8"><title>Training Report</title></head>\n'
+        f'<body>\n<h1>Training Report</h1>\n<p>Updated {state["updated"]}</p>\n'
+        f'<table border="1">\n{table}\n</table>\n{images}\n</body></html>\n'
+    )
+    _atomic_write(results_dir / 'summary.html', html)
+
+
+def _render(kind, payload, results_dir, state):
+    """Render one request into the results directory"""
+    from utils.visualization import (
+        plot_training_history,
+        plot_confusion_matrix,
+        plot_per_class_metrics
+    )
+    
+    preset = QUALITY_PRESETS[payload['quality']]
+    plots = set(state.get('plots', []))
+    
+    if kind == 'history':
+        plot_training_history(
+            payload['history'],
+            save_path=results_dir / 'training_history.png',
+            dpi=preset['dpi']
+        )
+        plots.add('training_history.png')
+        state['history'] = payload['history']
+    elif kind == 'evaluation':
+        import numpy as np
+        
+        plot_confusion_matrix(
+            np.asarray(payload['confusion_matrix']),
+            payload['class_names'],
+            save_path=results_dir / 'confusion_matrix.png',
+            dpi=preset['dpi'],
+            annotate=preset['annotate']
+        )
+        plots.add('confusion_matrix.png')
+        if payload.get('per_class') is not None:
+            plot_per_class_metrics(
+                payload['per_class'],
+                payload['class_names'],
+                save_path=results_dir / 'per_class_metrics.png',
+                dpi=preset['dpi']
+            )
+            plots.add('per_class_metrics.png')
+        state['evaluation'] = {'metrics': payload.get('metrics', {})}
+    
+    state['plots'] = sorted(plots)
+    state['updated'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    _write_summary(results_dir, state)
+
+
+def _worker_loop(request_queue, results_dir):
+    """Renderer process entry point"""
+    import matplotlib
+    matplotlib.use('Agg')
+    
+    results_dir = Path(results_dir)
+    state = {}
+    running = True
+    
+    while running:
+        pending = {}
+        item = request_queue.get()
+        
+        # Drain everything already queued, keeping only the newest per kind
+        while True:
+            if item is None:
+                running = False
+            else:
+                kind, payload = item
+                pending.pop(kind, None)
+                pending[kind] = payload
+            try:
+                item = request_queue.get_nowait()
+            except queue.Empty:
+                break
+        
+        for kind, payload in pending.items():
+            try:
+                _render(kind, payload, results_dir, state)
+            except Exception as e:
+                print(f"Report rendering failed for '{kind}': {e}")
+
+
+class ReportWorker:
+    """
+    Renders training reports in a background process
+    
+    Submissions never block: snapshots are copied and handed to a queue, and
+    the renderer process keeps only the latest snapshot of each kind.
+    """
+    
+    def __init__(self, results_dir, quality=config.REPORT_QUALITY):
+        """
+        Args:
+            results_dir: Directory where plots and summaries are written
+            quality: Default quality preset ('draft', 'standard', 'publication')
+        """
+        if quality not in QUALITY_PRESETS:
+            raise ValueError(f"Quality {quality} not supported. Choose from {list(QUALITY_PRESETS.keys())}")
+        
+        self.results_dir = Path(results_dir)
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        self.quality = quality
+        
+        ctx = mp.get_context('spawn')
+        self._queue = ctx.Queue()
+        self._process = ctx.Process(
+            target=_worker_loop,
+            args=(self._queue, str(self.results_dir)),
+            daemon=True
+        )
+        self._process.start()
+    
+    def _submit(self, kind, payload, quality):
+        quality = quality or self.quality
+        if quality not in QUALITY_PRESETS:
+            raise ValueError(f"Quality {quality} not supported. Choose from {list(QUALITY_PRESETS.keys())}")
+        if not self._process.is_alive():
+            return
+        payload['quality'] = quality
+        self._queue.put((kind, payload))
+    
+    def submit_history(self, history, quality=None):
+        """
+        Queue a training history snapshot for plotting
+        
+        Args:
+            history: Dictionary with training history
+            quality: Quality preset overriding the default
+        
+        Raises:
+            ValueError: If quality is not a known preset
+        """
+        # Copy so later appends in the training loop cannot race the queue feeder
+        snapshot = {k: [float(v) for v in values] for k, values in history.items()}
+        self._submit('history', {'history': snapshot}, quality)
+    
+    def submit_evaluation(self, confusion_matrix, class_names, metrics=None,
+                          per_class=None, quality=None):
+        """
+        Queue evaluation results for plotting
+        
+        Args:
+            confusion_matrix: Confusion matrix
+            class_names: List of class names
+            metrics: Dictionary of aggregate metrics
+            per_class: Dictionary with per-class 'precision', 'recall' and 'f1'
+            quality: Quality preset overriding the default
+        
+        Raises:
+            ValueError: If quality is not a known preset
+        """
+        payload = {
+            'confusion_matrix': _to_builtin(confusion_matrix),
+            'class_names': list(class_names),
+            'metrics': _to_builtin(metrics or {}),
+            'per_class': _to_builtin(per_class) if per_class is not None else None,
+        }
+        self._submit('evaluation', payload, quality)
+    
+    def close(self, timeout=None):
+        """
+        Finish outstanding renders and stop the worker
+        
+        Args:
+            timeout: Seconds to wait for the worker (None waits indefinitely)
+        """
+        if self._process.is_alive():
+            self._queue.put(None)
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
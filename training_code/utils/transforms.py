@@ -1,6 +1,7 @@
 """
 Data augmentation and transformation pipelines
 """
+import torch.nn.functional as F
 from torchvision import transforms
 import config
 
@@ -51,3 +52,25 @@ def get_val_transforms(img_size=config.IMG_SIZE):
         transforms.ToTensor(),
         transforms.Normalize(mean=config.MEAN, std=config.STD)
     ])
+
+
+def resize_normalize_batch(images, img_size, mean, std):
+    """
+    Resize and normalize a batch of uint8 images on their device
+    
+    Args:
+        images: uint8 tensor [N, 3, H, W]
+        img_size: Target image size
+        mean: Normalization mean tensor broadcastable to [N, 3, 1, 1]
+        std: Normalization std tensor broadcastable to [N, 3, 1, 1]
+    
+    Returns:
+        Normalized float tensor [N, 3, img_size, img_size]
+    """
+    view = images.float().div_(255)
+    if view.shape[-1] != img_size or view.shape[-2] != img_size:
+        view = F.interpolate(
+            view, size=(img_size, img_size),
+            mode='bilinear', align_corners=False, antialias=True
+        )
+    return (view - mean) / std
@@ -7,13 +7,14 @@ import numpy as np
 from pathlib import Path
 
 
-def plot_training_history(history, save_path=None):
+def plot_training_history(history, save_path=None, dpi=300):
     """
     Plot training history (loss, accuracy, F1)
     
     Args:
         history: Dictionary with training history
         save_path: Path to save the plot
+        dpi: Resolution of the saved plot
     """
     fig, axes = plt.subplots(1, 3, figsize=(18, 5))
     
@@ -47,13 +48,13 @@ def plot_training_history(history, save_path=None):
     plt.tight_layout()
     
     if save_path:
-        plt.savefig(save_path, dpi=300, bbox_inches='tight')
+        plt.savefig(save_path, dpi=dpi, bbox_inches='tight')
         print(f"Training history plot saved to {save_path}")
     
     plt.close()
 
 
-def plot_confusion_matrix(cm, class_names, save_path=None):
+def plot_confusion_matrix(cm, class_names, save_path=None, dpi=300, annotate=True):
     """
     Plot confusion matrix heatmap
     
@@ -61,6 +62,8 @@ def plot_confusion_matrix(cm, class_names, save_path=None):
         cm: Confusion matrix
         class_names: List of class names
         save_path: Path to save the plot
+        dpi: Resolution of the saved plot
+        annotate: Whether to write the value into every cell
     """
     plt.figure(figsize=(14, 12))
     
@@ -70,7 +73,7 @@ def plot_confusion_matrix(cm, class_names, save_path=None):
     # Create heatmap
     sns.heatmap(
         cm_normalized,
-        annot=True,
+        annot=annotate,
         fmt='.2f',
         cmap='Blues',
         xticklabels=class_names,
@@ -86,13 +89,13 @@ def plot_confusion_matrix(cm, class_names, save_path=None):
     plt.tight_layout()
     
     if save_path:
-        plt.savefig(save_path, dpi=300, bbox_inches='tight')
+        plt.savefig(save_path, dpi=dpi, bbox_inches='tight')
         print(f"Confusion matrix plot saved to {save_path}")
     
     plt.close()
 
 
-def plot_per_class_metrics(metrics_dict, class_names, save_path=None):
+def plot_per_class_metrics(metrics_dict, class_names, save_path=None, dpi=300):
     """
     Plot per-class performance metrics
     
@@ -100,6 +103,7 @@ def plot_per_class_metrics(metrics_dict, class_names, save_path=None):
         metrics_dict: Dictionary with per-class metrics
         class_names: List of class names
         save_path: Path to save the plot
+        dpi: Resolution of the saved plot
     """
     fig, axes = plt.subplots(1, 3, figsize=(18, 6))
     
@@ -135,7 +139,7 @@ def plot_per_class_metrics(metrics_dict, class_names, save_path=None):
     plt.tight_layout()
     
     if save_path:
-        plt.savefig(save_path, dpi=300, bbox_inches='tight')
+        plt.savefig(save_path, dpi=dpi, bbox_inches='tight')
         print(f"Per-class metrics plot saved to {save_path}")
     
     plt.close()